@@ -15,7 +15,8 @@ import numpy as np
 import pyamg
 import matplotlib.pyplot as plt
 from matplotlib.patches import Polygon
-#from my_vis import shrink_elmts, my_vis
+from my_vis import shrink_elmts
+#from my_vis import my_vis
 
 print("\nDiffusion problem discretized with p=5 and the local\n" +
       "discontinuous Galerkin method.")
@@ -100,18 +101,7 @@ for i, r in enumerate(resvec):
 
 print(sa)
 # first shrink the elements
-E = elements
-m = E.shape[1]
-Vs = np.zeros((m*E.shape[0], 2))
-Es = np.zeros((E.shape[0], m), dtype=np.int32)
-shrink = 0.75
-k = 0
-for i, e in enumerate(E):
-    xy = vertices[e, :]
-    xymean = xy.mean(axis=0)
-    Vs[k:k+m,:] = shrink * xy + (1-shrink) * np.kron(xy.mean(axis=0), np.ones((m, 1)))
-    Es[i,:] = np.arange(k, k+m)
-    k += m
+Es, Vs = shrink_elmts(elements, vertices, shrink=0.75)
 
 AggOp = sa.levels[0].AggOp
 count = np.array(AggOp.sum(axis=0)).ravel()
@@ -0,0 +1 @@
+../util/my_vis.py
\ No newline at end of file
@@ -0,0 +1,61 @@
+"""Scaling of edge AMG on structured H(curl) problems
+
+Reports the edgeAMG setup time, the number of preconditioned CG
+iterations, and the time per iteration as the grid is refined.
+
+Run with
+
+    python benchmark.py --dim 3
+
+and optionally `--smoother l1_jacobi` or `--smoother chebyshev` to select the
+relaxation in the Hiptmair smoother.
+"""
+import sys
+from time import perf_counter
+
+import numpy as np
+import pyamg
+
+from edgeAMG import edgeAMG
+from structured_hcurl import structured_hcurl
+
+dim = 3
+if '--dim' in sys.argv:
+    dim = int(sys.argv[sys.argv.index('--dim') + 1])
+smoother = 'gauss_seidel'
+if '--smoother' in sys.argv:
+    smoother = sys.argv[sys.argv.index('--smoother') + 1]
+
+if dim == 2:
+    nlist = [16, 32, 64, 128, 256]
+else:
+    nlist = [4, 8, 12, 16, 24, 32]
+
+fw = 11
+header = ['n', 'Edges', 'Setup', 'Iterations', 'Time/iter', 'Solve']
+hline = '|'.join(["-"*(fw+2) for h in header])
+header = '|'.join([f'{h:^{fw+2}}' for h in header])
+print(f'{dim}D structured H(curl), {smoother} Hiptmair smoothing')
+print('|'+header+'|')
+print('|'+hline+'|')
+
+np.random.seed(2024)
+for n in nlist:
+    data = structured_hcurl(n, dim=dim)
+    Acurl = data['Acurl']
+
+    tic = perf_counter()
+    ml = edgeAMG(data['Anode'], Acurl, data['D'], smoother=smoother)
+    setup_time = perf_counter() - tic
+
+    b = Acurl @ np.random.rand(Acurl.shape[0])
+    residuals = []
+    tic = perf_counter()
+    x, info = pyamg.krylov.cg(Acurl, b, np.zeros_like(b), M=ml.aspreconditioner(),
+                              tol=1e-8, maxiter=500, residuals=residuals)
+    solve_time = perf_counter() - tic
+    iterations = len(residuals) - 1
+
+    print(f'| {n:>{fw}d} | {Acurl.shape[0]:>{fw}d} | {setup_time:{fw}.5f} '
+          f'| {iterations:>{fw}d} | {solve_time / iterations:{fw}.5f} '
+          f'| {solve_time:{fw}.5f} |')
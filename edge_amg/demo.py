@@ -1,16 +1,16 @@
 """ Lowest order edge AMG implementing Reitzinger-Schoberl algorithm"""
 
 import numpy as np
-import scipy
-import scipy.sparse as sparse
 import matplotlib.pyplot as plt
 import pyamg
 
 from edgeAMG import edgeAMG
+from mmcache import mmread_csr
 
-Acurl = sparse.csr_matrix(scipy.io.mmread("HCurlStiffness.dat"))
-Anode = sparse.csr_matrix(scipy.io.mmread("H1Stiffness.dat"))
-D = sparse.csr_matrix(scipy.io.mmread("D.dat"))
+# the Matrix Market files are converted to a binary cache on first use
+Acurl = mmread_csr("HCurlStiffness.dat")
+Anode = mmread_csr("H1Stiffness.dat")
+D = mmread_csr("D.dat")
 
 ml = edgeAMG(Anode, Acurl, D)
 MLOp = ml.aspreconditioner()
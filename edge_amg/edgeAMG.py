@@ -6,113 +6,351 @@ import scipy.sparse as sparse
 
 import pyamg
 
-__all__ = ['edgeAMG']
+__all__ = ['edgeAMG', 'edgeAMG_update']
 
 make_system = pyamg.relaxation.relaxation.make_system
 gauss_seidel = pyamg.relaxation.relaxation.gauss_seidel
+chebyshev_polynomial_coefficients = \
+    pyamg.relaxation.chebyshev.chebyshev_polynomial_coefficients
+approximate_spectral_radius = pyamg.util.linalg.approximate_spectral_radius
 
 
-def hiptmair_smoother(A, x, b, D, iterations=1, sweep='symmetric'):
-    A, x, b = make_system(A, x, b, formats=['csr', 'bsr'])
-    gauss_seidel(A, x, b, iterations=1, sweep='forward')
+def hiptmair_smoother(A, x, b, D, relax_A, relax_G, iterations=1,
+                      sweep='symmetric'):
+    """Hiptmair smoother: relaxation on the edges, then on the nodal
+    auxiliary space with operator A_G = D.T A D, then on the edges again.
+
+    relax_A and relax_G are relaxation methods on A and A_G of the form
+    relax(x, b, sweep), see setup_hiptmair.  A 'forward' sweep relaxes on the
+    edges and then on the nodes, a 'backward' sweep reverses this order, and
+    a 'symmetric' sweep is a forward sweep followed by a backward sweep.
+    """
+    A, x, b = make_system(A, x, b, formats=['csr'])
+    for _ in range(iterations):
+        if sweep in ('forward', 'symmetric'):
+            relax_A(x, b, 'forward')
+
+        r = b - A @ x
+        x_G = np.zeros(D.shape[1], dtype=x.dtype)
+        relax_G(x_G, D.T @ r, sweep)
+        x += D @ x_G
+
+        if sweep in ('backward', 'symmetric'):
+            relax_A(x, b, 'backward')
 
-    r = b - A * x
-    x_G = np.zeros(D.shape[1])
-    A_G, x_G, b_G = make_system(
-        D.T * A * D, x_G, D.T * r, formats=['csr', 'bsr'])
-    gauss_seidel(A_G, x_G, b_G, iterations=1, sweep='symmetric')
-    x[:] += D * x_G
-    gauss_seidel(A, x, b, iterations=1, sweep='backward')
 
+def setup_hiptmair(lvl, iterations=1, sweep='symmetric', relax='gauss_seidel',
+                   degree=3):
+    """Build a Hiptmair smoother for the level lvl.
+
+    The CSR edge operator and the nodal auxiliary operator D.T A D are
+    formed once here and stored on the level, so that applying the
+    smoother only requires relaxation sweeps and matvecs.
+
+    Parameters
+    ----------
+    lvl : Level
+        Level with the edge matrix A and the discrete gradient D
+    iterations : int
+        Number of Hiptmair sweeps per application
+    sweep : {'forward', 'backward', 'symmetric'}
+        Direction of each Hiptmair sweep
+    relax : {'gauss_seidel', 'l1_jacobi', 'chebyshev'}
+        Relaxation used in the edge and nodal spaces.  'l1_jacobi' and
+        'chebyshev' only use sparse matvecs, which is cheaper in parallel than
+        the sequential Gauss-Seidel sweeps, but usually somewhat less
+        effective per sweep.
+    degree : int
+        Degree of the Chebyshev polynomial
+    """
+    if sweep not in ('forward', 'backward', 'symmetric'):
+        raise ValueError(f'unrecognized sweep: {sweep}')
+    if relax not in ('gauss_seidel', 'l1_jacobi', 'chebyshev'):
+        raise ValueError(f'unrecognized relaxation method: {relax}')
 
-def setup_hiptmair(lvl, iterations=1, sweep='symmetric'):
+    if not hasattr(lvl, 'A_G'):
+        lvl.A = canonical_csr(lvl.A)
+        lvl.D = lvl.D.tocsr()
+        lvl.A_G = canonical_csr(lvl.D.T @ lvl.A @ lvl.D)
+    A = lvl.A
     D = lvl.D
 
-    def smoother(A, x, b):
-        hiptmair_smoother(A, x, b, D, iterations=iterations, sweep=sweep)
+    if relax == 'gauss_seidel':
+        relax_A = _setup_gauss_seidel(A)
+        relax_G = _setup_gauss_seidel(lvl.A_G)
+    elif relax == 'l1_jacobi':
+        relax_A = _setup_l1_jacobi(A)
+        relax_G = _setup_l1_jacobi(lvl.A_G)
+    else:
+        relax_A = _setup_chebyshev(A, degree)
+        relax_G = _setup_chebyshev(lvl.A_G, degree)
+
+    def smoother(_A, x, b):
+        hiptmair_smoother(A, x, b, D, relax_A, relax_G,
+                          iterations=iterations, sweep=sweep)
     return smoother
 
 
-def edgeAMG(Anode, Acurl, D):
+def _setup_gauss_seidel(A):
+    def relax(x, b, sweep):
+        gauss_seidel(A, x, b, iterations=1, sweep=sweep)
+    return relax
+
+
+def _l1_diagonal_inverse(A):
+    d = np.ravel(abs(A).sum(axis=1))
+    dinv = np.zeros_like(d)
+    dinv[d != 0] = 1.0 / d[d != 0]
+    return dinv
+
+
+def _setup_l1_jacobi(A):
+    # l1-Jacobi, x += (b - A x) / sum_j |a_ij|, is convergent without damping
+    dinv = _l1_diagonal_inverse(A)
+
+    def relax(x, b, _sweep):
+        x += dinv * (b - A @ x)
+    return relax
+
+
+def _setup_chebyshev(A, degree):
+    # Chebyshev polynomial in the l1-Jacobi scaled operator, x += p(S) S r
+    # with S = diag(1 / sum_j |a_ij|) A, whose spectral radius is at most one
+    # levels without coarse edges have an empty operator
+    if A.nnz == 0:
+        return lambda x, b, _sweep: None
+    dinv = _l1_diagonal_inverse(A)
+    S = sparse.csr_matrix(A.multiply(dinv.reshape(-1, 1)))
+    rho = approximate_spectral_radius(S)
+    if rho == 0:
+        return lambda x, b, _sweep: None
+    coefficients = -chebyshev_polynomial_coefficients(rho / 30.0, 1.1 * rho,
+                                                      degree)[:-1]
+
+    def relax(x, b, _sweep):
+        r = dinv * (b - A @ x)
+        h = coefficients[0] * r
+        for c in coefficients[1:]:
+            h = c * r + S @ h
+        x += h
+    return relax
+
+
+def edgeAMG(Anode, Acurl, D, smoother=('gauss_seidel', {'sweep': 'symmetric'})):
+    """
+    Edge AMG (Reitzinger-Schoberl) hierarchy for the H(curl) matrix Acurl
+
+    Parameters
+    ----------
+    Anode : sparse matrix
+        Nodal (H1) matrix, used to aggregate the nodes
+    Acurl : sparse matrix
+        Edge (H(curl)) matrix
+    D : sparse matrix
+        Discrete gradient, mapping nodes to edges
+    smoother : tuple
+        Relaxation method and parameters of the Hiptmair smoother, e.g.,
+        ('l1_jacobi', {'iterations': 2}).  See setup_hiptmair.
+    """
+    if isinstance(smoother, tuple):
+        relax, smoother_args = smoother
+    else:
+        relax, smoother_args = smoother, {}
+
     nodalAMG = pyamg.smoothed_aggregation_solver(Anode, max_coarse=10, keep=True)
 
     # construct multilevel structure
     levels = []
     levels.append(pyamg.MultilevelSolver.Level())
-    levels[-1].A = Acurl
+    levels[-1].A = canonical_csr(Acurl)
     levels[-1].D = D
     for i in range(1, len(nodalAMG.levels)):
         A = levels[-1].A
         Pnode = nodalAMG.levels[i - 1].AggOp
-        P = findPEdge(D, Pnode)
+        P, D = findPEdge(D, Pnode)
         R = P.T
         levels[-1].P = P
         levels[-1].R = R
+        A = canonical_csr(R @ A @ P)
         levels.append(pyamg.MultilevelSolver.Level())
-        A = R * A * P
-        M = sparse.dia_matrix((1.0 / ((P.T * P).diagonal()), 0),
-                              shape=(P.shape[1], P.shape[1]))
-        D = M * (P.T * D * Pnode)
-        D = D.tocsr()
         levels[-1].A = A
         levels[-1].D = D
 
     edgeML = pyamg.MultilevelSolver(levels)
-    for i in range(0, len(edgeML.levels)):
-        edgeML.levels[i].presmoother = setup_hiptmair(levels[i])
-        edgeML.levels[i].postsmoother = setup_hiptmair(levels[i])
+    for lvl in edgeML.levels:
+        # kept for edgeAMG_update, which sets up the smoothers again
+        lvl.hiptmair_args = dict(smoother_args, relax=relax)
+    _setup_smoothers(edgeML)
     return edgeML
 
 
+def _setup_smoothers(ml):
+    for lvl in ml.levels:
+        lvl.presmoother = setup_hiptmair(lvl, **lvl.hiptmair_args)
+        lvl.postsmoother = setup_hiptmair(lvl, **lvl.hiptmair_args)
+
+
+def edgeAMG_update(ml, Acurl):
+    """Update an edgeAMG hierarchy for new coefficients in Acurl.
+
+    The nodal aggregation, the edge prolongators and the coarse discrete
+    gradients of ml are kept.  The Galerkin products R A P and the nodal
+    auxiliary operators of the Hiptmair smoothers are recomputed, in place,
+    from value maps (see galerkin_map), and the smoothers are set up again,
+    as l1-Jacobi and Chebyshev store scalings and spectral bounds of the
+    operators.  The maps only depend on the sparsity patterns of the
+    hierarchy.  As they take several times the memory of the operators,
+    they are built on the first call rather than in edgeAMG, and kept on
+    the levels (lvl.A_map and lvl.A_G_map) for later calls.
+
+    Parameters
+    ----------
+    ml : MultilevelSolver
+        Hierarchy returned by edgeAMG
+    Acurl : sparse matrix
+        New edge matrix, with the same sparsity pattern as the matrix
+        used to build ml
+
+    Returns
+    -------
+    ml, updated in place
+    """
+    A = canonical_csr(Acurl)
+    A0 = ml.levels[0].A
+    if A.shape != A0.shape or A.nnz != A0.nnz or \
+            not np.array_equal(A.indptr, A0.indptr) or \
+            not np.array_equal(A.indices, A0.indices):
+        raise ValueError('Acurl must have the same sparsity pattern as '
+                         'the matrix used to build the hierarchy')
+
+    if not hasattr(ml.levels[0], 'A_G_map'):
+        _galerkin_maps(ml)
+
+    # rebind (rather than overwrite) the data of the fine matrix, which may be
+    # shared with the caller's previous Acurl or be a read-only memory map
+    A0.data = A.data
+    for i, lvl in enumerate(ml.levels):
+        if i < len(ml.levels) - 1:
+            ml.levels[i + 1].A.data[:] = lvl.A_map @ lvl.A.data
+        lvl.A_G.data[:] = lvl.A_G_map @ lvl.A.data
+    _setup_smoothers(ml)
+
+    # drop the cached factorization of the old coarse operator
+    vars(ml.coarse_solver).clear()
+    return ml
+
+
+def _galerkin_maps(ml):
+    # the coarse operators are replaced by the ones of galerkin_map, with
+    # the same values but structural sparsity patterns
+    for i, lvl in enumerate(ml.levels):
+        if i < len(ml.levels) - 1:
+            ml.levels[i + 1].A, lvl.A_map = galerkin_map(lvl.A, lvl.P)
+        lvl.A_G, lvl.A_G_map = galerkin_map(lvl.A, lvl.D)
+
+
+def canonical_csr(A):
+    """Return A in CSR format with sorted indices and no duplicates."""
+    A = sparse.csr_matrix(A)
+    if not A.has_canonical_format:
+        A = A.copy()
+        A.sum_duplicates()
+    return A
+
+
+def galerkin_map(A, P):
+    """
+    Compute the Galerkin product Ac = P.T A P together with a value map M,
+    so that Ac.data = M @ A.data for any matrix with the sparsity pattern of A
+
+    A must be in canonical CSR format.  The sparsity pattern of Ac is the
+    structural one, i.e., entries that cancel are kept as explicit zeros, so
+    that the pattern does not depend on the values in A.
+    """
+    P = sparse.csr_matrix(P)
+    n = A.shape[0]
+    nc = P.shape[1]
+
+    # fine nonzero k = (i, j) contributes P[i, I] * A[i, j] * P[j, J] to Ac[I, J]
+    rows = np.repeat(np.arange(n), np.diff(A.indptr))
+    cols = A.indices
+    Pcount = np.diff(P.indptr)
+
+    k, pi = _expand(np.arange(A.nnz), P.indptr[rows], Pcount[rows])
+    m, pj = _expand(np.arange(len(k)), P.indptr[cols[k]], Pcount[cols[k]])
+    k, pi = k[m], pi[m]
+
+    key = P.indices[pi].astype(np.int64) * nc + P.indices[pj]
+    key, pos = np.unique(key, return_inverse=True)
+    M = sparse.csr_matrix((P.data[pi] * P.data[pj], (pos, k)),
+                          shape=(len(key), A.nnz))
+
+    indptr = np.zeros(nc + 1, dtype=np.int64)
+    np.cumsum(np.bincount(key // nc, minlength=nc), out=indptr[1:])
+    Ac = sparse.csr_matrix((M @ A.data, key % nc, indptr), shape=(nc, nc))
+    return Ac, M
+
+
+def _expand(src, start, count):
+    """Repeat each src[m] count[m] times, pairing it with the index range
+    start[m], ..., start[m] + count[m] - 1."""
+    offset = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    return np.repeat(src, count), np.repeat(start, count) + offset
+
+
 def findPEdge(D, PNode):
     """
     use D to find edges
     each row has exactly two non zeros, a -1 marking the start node, and 1
     marking the end node
+
+    Returns the edge prolongator PEdge and the coarse discrete gradient.
+    A fine edge between two nodal aggregates is mapped, with sign +-1, to the
+    coarse edge between the aggregates, which is oriented and numbered as
+    the first fine edge that maps to it.  Edges inside an aggregate are
+    dropped.  The coarse discrete gradient is then read off directly, which
+    equals diag(1 / diag(PEdge.T PEdge)) PEdge.T D PNode.
     """
+    D = sparse.csr_matrix(D)
     numEdges = D.shape[0]
-    edges = np.zeros((numEdges, 2), dtype=int)
-    DRowInd = D.nonzero()[0]
-    DColInd = D.nonzero()[1]
-    for i in range(0, numEdges):
-        if (D[DRowInd[2 * i], DColInd[2 * i]] == -
-                1.0):  # first index is start, second is end
-            edges[DRowInd[2 * i], 0] = DColInd[2 * i]
-            edges[DRowInd[2 * i], 1] = DColInd[2 * i + 1]
-        else:  # first index is end, second is start
-            edges[DRowInd[2 * i], 0] = DColInd[2 * i + 1]
-            edges[DRowInd[2 * i], 1] = DColInd[2 * i]
+    cols = D.indices.reshape(numEdges, 2)
+    first_is_start = D.data.reshape(numEdges, 2)[:, 0] == -1.0
+    start = np.where(first_is_start, cols[:, 0], cols[:, 1])
+    end = np.where(first_is_start, cols[:, 1], cols[:, 0])
 
     # now that we have the edges, we need to find the nodal aggregates
     # the nodal aggregates are the columns
+    # each row has 1 nonzero and that column is its aggregate (-1 if none)
+    PNode = sparse.csr_matrix(PNode)
+    numAggs = PNode.shape[1]
+    aggs = np.full(PNode.shape[0], -1, dtype=np.int64)
+    aggs[np.diff(PNode.indptr) > 0] = PNode.indices
+    coarseV1 = aggs[start]
+    coarseV2 = aggs[end]
 
-    # each row has 1 nonzero and that column is its aggregate
-    aggs = PNode.nonzero()[1]
-    numCoarseEdges = 0
-    row = []
-    col = []
-    data = []
-    coarseEdges = {}
-    for i in range(0, edges.shape[0]):
-        coarseV1 = aggs[edges[i, 0]]
-        coarseV2 = aggs[edges[i, 1]]
-        if (coarseV1 != coarseV2):  # this is a coarse edges
-            # check if in dictionary
-            if ((coarseV1, coarseV2) in coarseEdges):
-                row.append(i)
-                col.append(coarseEdges[(coarseV1, coarseV2)])
-                data.append(1)
-            elif ((coarseV2, coarseV1) in coarseEdges):
-                row.append(i)
-                col.append(coarseEdges[(coarseV2, coarseV1)])
-                data.append(-1)
-            else:
-                coarseEdges[(coarseV1, coarseV2)] = numCoarseEdges
-                numCoarseEdges = numCoarseEdges + 1
-                row.append(i)
-                col.append(coarseEdges[(coarseV1, coarseV2)])
-                data.append(1)
-
-    PEdge = sparse.csr_matrix((data, (row, col)),
+    # fine edges between two aggregates are coarse edges
+    fine = np.flatnonzero((coarseV1 != coarseV2) & (coarseV1 >= 0) & (coarseV2 >= 0))
+    coarseV1 = coarseV1[fine]
+    coarseV2 = coarseV2[fine]
+    key = np.minimum(coarseV1, coarseV2) * numAggs + np.maximum(coarseV1, coarseV2)
+    _, first, coarse = np.unique(key, return_index=True, return_inverse=True)
+
+    # number the coarse edges by first appearance, and orient them as the
+    # first fine edge in each
+    numCoarseEdges = len(first)
+    order = np.argsort(first)
+    number = np.empty(numCoarseEdges, dtype=np.int64)
+    number[order] = np.arange(numCoarseEdges)
+    coarse = number[coarse]
+    first = first[order]
+    sign = np.where(coarseV1 == coarseV1[first][coarse], 1, -1)
+
+    PEdge = sparse.csr_matrix((sign, (fine, coarse)),
                               shape=(numEdges, numCoarseEdges))
-    return PEdge
+
+    row = np.repeat(np.arange(numCoarseEdges), 2)
+    col = np.column_stack((coarseV1[first], coarseV2[first])).ravel()
+    data = np.tile([-1.0, 1.0], numCoarseEdges)
+    Dc = sparse.csr_matrix((data, (row, col)),
+                           shape=(numCoarseEdges, numAggs))
+    return PEdge, Dc
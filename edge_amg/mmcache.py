@@ -0,0 +1,91 @@
+"""Binary cache for Matrix Market files
+
+The first time a Matrix Market file is read, the matrix is converted to CSR
+and its arrays are saved as .npy files in a cache directory next to the
+source file, e.g., D.dat.cache/.  Later reads memory-map these arrays, so
+no text parsing (and no copy) is needed.  The cache is rebuilt whenever the
+size or modification time of the source file changes.
+"""
+
+import json
+import os
+
+import numpy as np
+import scipy.io
+import scipy.sparse as sparse
+
+__all__ = ['mmread_csr']
+
+_VERSION = 1
+_ARRAYS = ('data', 'indices', 'indptr')
+
+
+def mmread_csr(fname, mmap=True):
+    """
+    Read a Matrix Market file as a CSR matrix, through a binary cache
+
+    Parameters
+    ----------
+    fname : string
+        Matrix Market file, e.g. 'D.dat'
+    mmap : bool
+        If True, the arrays of the returned matrix are read-only memory maps
+        of the cache files.  Otherwise, they are loaded into memory.
+
+    Returns
+    -------
+    A : csr_matrix
+        Matrix in canonical CSR format (sorted indices, no duplicates)
+    """
+    cachedir = fname + '.cache'
+    stamp = _stamp(fname)
+
+    meta = _read_meta(cachedir)
+    if meta is None or meta['source'] != stamp:
+        A = sparse.csr_matrix(scipy.io.mmread(fname))
+        A.sum_duplicates()
+        _write_cache(cachedir, A, stamp)
+        return A
+
+    mmap_mode = 'r' if mmap else None
+    data, indices, indptr = \
+        [np.load(os.path.join(cachedir, name + '.npy'), mmap_mode=mmap_mode)
+         for name in _ARRAYS]
+    return sparse.csr_matrix((data, indices, indptr),
+                             shape=tuple(meta['shape']), copy=False)
+
+
+def _stamp(fname):
+    st = os.stat(fname)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def _read_meta(cachedir):
+    try:
+        with open(os.path.join(cachedir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != _VERSION:
+        return None
+    return meta
+
+
+def _write_cache(cachedir, A, stamp):
+    os.makedirs(cachedir, exist_ok=True)
+
+    # invalidate first, and write the metadata last, so that an
+    # interrupted write is never mistaken for a valid cache
+    metafile = os.path.join(cachedir, 'meta.json')
+    if os.path.exists(metafile):
+        os.remove(metafile)
+
+    for name in _ARRAYS:
+        tmp = os.path.join(cachedir, name + '.tmp.npy')
+        np.save(tmp, getattr(A, name))
+        os.replace(tmp, os.path.join(cachedir, name + '.npy'))
+
+    meta = {'version': _VERSION, 'shape': list(A.shape), 'source': stamp}
+    with open(metafile + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(metafile + '.tmp', metafile)
@@ -0,0 +1,134 @@
+"""Lowest order Nedelec (edge) discretizations on structured grids
+
+The spaces on a tensor-product grid of the unit square or cube are tensor
+products of 1D continuous P1 and discontinuous P0 spaces, so all matrices
+are Kronecker products of small 1D matrices.  For a 1D grid with n cells
+
+    G1 : (n x n+1) difference matrix, from P1 to P0
+    M1 : (n+1 x n+1) P1 mass matrix
+    M0 : (n x n) P0 mass matrix, for the basis functions 1/h on a cell
+
+The degrees of freedom are the circulations of a field along the edges (and
+its fluxes through the faces), as D and C are +-1 incidence matrices, so the
+P0 factor of an edge or face basis function is 1/h rather than 1, and M0 is
+I/h.
+
+In 3D, with the x index varying fastest, x-edges are P0 in x and P1 in y and
+z, x-faces are P1 in x and P0 in y and z, and so on.  The discrete gradient
+and curl are incidence matrices (entries +-1) built from G1 and identities,
+and the matrices of the exact sequence are
+
+    Anode = D.T Medge D               (Q1 stiffness matrix)
+    Acurl = C.T Mface C + sigma Medge (Nedelec curl-curl plus mass matrix)
+"""
+
+import numpy as np
+import scipy.sparse as sparse
+
+__all__ = ['structured_hcurl']
+
+
+def _kron(*mats):
+    K = mats[0]
+    for M in mats[1:]:
+        K = sparse.kron(K, M, format='csr')
+    return sparse.csr_matrix(K)
+
+
+def _oned(n):
+    h = 1.0 / n
+    G1 = sparse.diags([-np.ones(n), np.ones(n)], [0, 1], shape=(n, n + 1),
+                      format='csr')
+    d = np.full(n + 1, 4.0)
+    d[[0, -1]] = 2.0
+    M1 = sparse.diags([np.ones(n), d, np.ones(n)], [-1, 0, 1],
+                      format='csr') * (h / 6.0)
+    M0 = sparse.identity(n, format='csr') / h
+    I1 = sparse.identity(n + 1, format='csr')
+    I0 = sparse.identity(n, format='csr')
+    return G1, M1, M0, I1, I0
+
+
+def structured_hcurl(n, dim=3, sigma=1.0):
+    """
+    Curl-curl plus mass matrix, nodal Laplacian and discrete gradient for
+    lowest order Nedelec elements on a structured grid
+
+    Parameters
+    ----------
+    n : int
+        Number of cells in each direction of the unit square or cube
+    dim : {2, 3}
+        Spatial dimension (quadrilateral or hexahedral cells)
+    sigma : float
+        Coefficient of the edge mass matrix, i.e., the operator is
+        curl curl E + sigma E, with natural boundary conditions
+
+    Returns
+    -------
+    dictionary containing:
+
+    Acurl : csr_matrix
+        (Nedges x Nedges) edge matrix
+    Anode : csr_matrix
+        (Nnodes x Nnodes) Q1 stiffness matrix (singular, natural boundary
+        conditions)
+    D : csr_matrix
+        (Nedges x Nnodes) discrete gradient, with -1 at the start node and 1
+        at the end node of each edge
+    vertices : array
+        (Nnodes x dim) node coordinates
+
+    Examples
+    --------
+    >>> from structured_hcurl import structured_hcurl
+    >>> from edgeAMG import edgeAMG
+    >>> data = structured_hcurl(16, dim=3)
+    >>> ml = edgeAMG(data['Anode'], data['Acurl'], data['D'])
+    """
+    G1, M1, M0, I1, I0 = _oned(n)
+
+    if dim == 2:
+        # edges: x-edges (P1 in y, P0 in x), then y-edges (P0 in y, P1 in x)
+        D = sparse.vstack([_kron(I1, G1),
+                           _kron(G1, I1)], format='csr')
+        # scalar curl on cells: d/dx u_y - d/dy u_x
+        C = sparse.hstack([-_kron(G1, I0),
+                           _kron(I0, G1)], format='csr')
+        Medge = sparse.block_diag([_kron(M1, M0),
+                                   _kron(M0, M1)], format='csr')
+        Mface = _kron(M0, M0)
+    elif dim == 3:
+        # edges: x-, y-, then z-edges, with Kronecker factors ordered (z, y, x)
+        D = sparse.vstack([_kron(I1, I1, G1),
+                           _kron(I1, G1, I1),
+                           _kron(G1, I1, I1)], format='csr')
+        # faces: x-, y-, then z-faces
+        #   (curl u)_x = d/dy u_z - d/dz u_y
+        #   (curl u)_y = d/dz u_x - d/dx u_z
+        #   (curl u)_z = d/dx u_y - d/dy u_x
+        Z = None
+        C = sparse.bmat([[Z, -_kron(G1, I0, I1), _kron(I0, G1, I1)],
+                         [_kron(G1, I1, I0), Z, -_kron(I0, I1, G1)],
+                         [-_kron(I1, G1, I0), _kron(I1, I0, G1), Z]],
+                        format='csr')
+        Medge = sparse.block_diag([_kron(M1, M1, M0),
+                                   _kron(M1, M0, M1),
+                                   _kron(M0, M1, M1)], format='csr')
+        Mface = sparse.block_diag([_kron(M0, M0, M1),
+                                   _kron(M0, M1, M0),
+                                   _kron(M1, M0, M0)], format='csr')
+    else:
+        raise ValueError('dim must be 2 or 3')
+
+    Acurl = (C.T @ Mface @ C + sigma * Medge).tocsr()
+    Anode = (D.T @ Medge @ D).tocsr()
+    Acurl.sum_duplicates()
+    Anode.sum_duplicates()
+
+    x = np.linspace(0.0, 1.0, n + 1)
+    grid = np.meshgrid(*(dim * (x,)), indexing='ij')
+    # x varies fastest
+    vertices = np.column_stack([g.ravel() for g in reversed(grid)])
+
+    return {'Acurl': Acurl, 'Anode': Anode, 'D': D, 'vertices': vertices}
@@ -0,0 +1,150 @@
+"""
+Shifted Laplacian vs. planewave SA preconditioning for Helmholtz problems
+
+Both hierarchies are used as preconditioners for GMRES applied to A.  For
+each problem, the setup time, the storage of the hierarchy (bytes of A, P
+and R on all levels, and the operator complexity), the number of GMRES
+iterations and the time to solution are reported.  A solve that does not
+reach the tolerance within maxiter iterations is marked `>maxiter`.
+
+The 1D problem (one_D_helmholtz) is run for several points-per-wavelength
+values; the 2D problem (helmholtz_2D) is stored at a fixed resolution.
+
+Run with
+
+    python benchmark_shifted.py
+
+and optionally `--beta 1.0` to change the imaginary shift.
+"""
+import sys
+from time import perf_counter
+
+import numpy as np
+import pyamg
+
+from one_D_helmholtz import one_D_helmholtz
+from smoothed_aggregation_helmholtz_solver import \
+    smoothed_aggregation_helmholtz_solver, planewaves, nbytes
+from shifted_laplacian import shifted_laplacian_solver
+
+beta = 0.5
+if '--beta' in sys.argv:
+    beta = float(sys.argv[sys.argv.index('--beta') + 1])
+
+tol = 1e-8
+maxiter = 300
+
+
+def hierarchy_bytes(ml):
+    total = 0
+    for lvl in ml.levels:
+        for name in ('A', 'P', 'R'):
+            if hasattr(lvl, name):
+                total += nbytes(getattr(lvl, name))
+    return total
+
+
+def run(A, build, cycle):
+    tic = perf_counter()
+    ml = build()
+    setup_time = perf_counter() - tic
+
+    np.random.seed(625)
+    x0 = np.random.rand(A.shape[0])
+    b = np.zeros_like(x0)
+    residuals = []
+    tic = perf_counter()
+    _, info = pyamg.krylov.gmres(A, b, x0=x0, M=ml.aspreconditioner(cycle=cycle),
+                                 tol=tol, maxiter=maxiter, residuals=residuals)
+    solve_time = perf_counter() - tic
+
+    return {'setup': setup_time,
+            'MB': hierarchy_bytes(ml) / 1e6,
+            'complexity': ml.operator_complexity(),
+            'iterations': len(residuals) - 1,
+            'converged': info == 0,
+            'solve': solve_time}
+
+
+fw = 10
+columns = ['Problem', 'Method', 'Setup', 'MB', 'OpCx', 'Iterations', 'Solve']
+hline = '|'.join(["-"*(fw+2) for c in columns])
+header = '|'.join([f'{c:^{fw+2}}' for c in columns])
+
+
+def report(problem, method, r):
+    iterations = str(r['iterations']) if r['converged'] else f'>{maxiter}'
+    print(f"| {problem:>{fw}} | {method:>{fw}} | {r['setup']:{fw}.4f} "
+          f"| {r['MB']:{fw}.3f} | {r['complexity']:{fw}.3f} "
+          f"| {iterations:>{fw}} | {r['solve']:{fw}.4f} |")
+
+
+print(f'GMRES to a relative residual of {tol:1.0e} (at most {maxiter} iterations, '
+      f'>{maxiter} if not converged), shift (1, {beta})')
+print('|'+header+'|')
+print('|'+hline+'|')
+
+# 1D, settings as in demo1d.py
+n = 1024
+mesh_h = 1.0 / (float(n) - 1.0)
+smooth = ('energy', {'krylov': 'gmres'})
+smoother = ('gauss_seidel_nr', {'sweep': 'symmetric', 'iterations': 1})
+build_args = {'max_levels': 10, 'max_coarse': 5, 'coarse_solver': 'pinv2',
+              'symmetry': 'symmetric', 'presmoother': smoother,
+              'postsmoother': smoother}
+
+for ppw in [8.0, 10.0, 15.0, 20.0, 30.0]:
+    omega = (2 * np.pi) / (mesh_h * ppw)
+    data = one_D_helmholtz(n, omega=omega, nplane_waves=2)
+    A = data['A'].tocsr()
+    problem = f'1D ppw={ppw:g}'
+
+    r = run(A, lambda: pyamg.smoothed_aggregation_solver(
+        A, B=data['B'], strength=('symmetric', {'theta': 0.0}),
+        smooth=smooth, **build_args), 'W')
+    report(problem, 'planewave', r)
+
+    r = run(A, lambda: shifted_laplacian_solver(
+        A, shift=(1.0, beta), mass=np.full(n, (mesh_h * omega)**2),
+        **build_args), 'V')
+    report(problem, 'shifted', r)
+
+# 2D, settings as in demo2d.py
+data = pyamg.gallery.load_example('helmholtz_2D')
+A = data['A'].tocsr()
+omega = data['omega']
+vertices = data['vertices']
+X = vertices[:, 0].copy()
+Y = vertices[:, 1].copy()
+problem = f"2D ppw={float(data['ppw'][0, 0]):g}"
+
+strength = [('distance', {'V': vertices, 'theta': 1e-5, 'relative_drop': False}),
+            ('symmetric', {'theta': 0.00})]
+smoother = [('gauss_seidel', {'iterations': 4, 'sweep': 'forward'}),
+            ('gauss_seidel_nr', {'iterations': 4, 'sweep': 'forward'})]
+build_args = {'max_levels': 10, 'max_coarse': 50, 'coarse_solver': 'pinv2',
+              'symmetry': 'symmetric', 'presmoother': smoother,
+              'postsmoother': smoother}
+pwave_args = [None,
+              (planewaves, {'X': X, 'Y': Y, 'omega': omega,
+                            'angles': list(np.linspace(0., np.pi / 2., 2))}),
+              (planewaves, {'X': X, 'Y': Y, 'omega': omega,
+                            'angles': list(np.linspace(-np.pi / 8., 5 * np.pi / 8., 4))}),
+              None]
+improve_candidates = [
+    ('gauss_seidel', {'iterations': 2, 'sweep': 'forward'}),
+    ('gauss_seidel_nr', {'iterations': 1, 'sweep': 'forward'})]
+
+r = run(A, lambda: smoothed_aggregation_helmholtz_solver(
+    A, planewaves=pwave_args, use_constant=(True, {'last_level': 0}),
+    strength=strength, aggregate=['naive', 'standard'],
+    smooth=('energy', {'krylov': 'cgnr', 'weighting': 'diagonal'}),
+    improve_candidates=improve_candidates, **build_args), 'W')
+report(problem, 'planewave', r)
+
+# the DG operator has no separate mass matrix: the lumped k^2 M is
+# recovered from the row sums of A (see shifted_laplacian)
+r = run(A, lambda: shifted_laplacian_solver(
+    A, shift=(1.0, beta), strength=strength, aggregate=['naive', 'standard'],
+    **build_args), 'V')
+report(problem, 'shifted', r)
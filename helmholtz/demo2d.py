@@ -8,6 +8,7 @@ from matplotlib.patches import Polygon
 from matplotlib.collections import PatchCollection
 
 from smoothed_aggregation_helmholtz_solver import smoothed_aggregation_helmholtz_solver, planewaves
+from my_vis import shrink_elmts
 
 # Retrieve 2-D Helmholtz Operator and problem data.
 # This is operator was discretized with a local
@@ -109,7 +110,7 @@ pwave_args = [None,
 # Use constant in B for interpolation, but only between levels 0 and 1
 use_constant = (True, {'last_level': 0})
 
-# Construct solver using planewaves
+# Construct solver using planewaves, and keep the aggregates for plotting
 sa = smoothed_aggregation_helmholtz_solver(
     A,
     planewaves=pwave_args,
@@ -120,6 +121,7 @@ sa = smoothed_aggregation_helmholtz_solver(
     improve_candidates=improve_candidates,
     presmoother=smoother,
     postsmoother=smoother,
+    keep=True,
     **SA_build_args)
 
 # Solve
@@ -134,13 +136,7 @@ for i, r in enumerate(residuals):
 
 print(sa)
 # first shrink the elements
-E = elements
-Vs = np.zeros((3*E.shape[0], 3))
-shrink = 0.75
-for i, e in enumerate(E):
-    xy = vertices[e, :]
-    xymean = xy.mean(axis=0)
-    Vs[e,:] = shrink * xy + (1-shrink) * np.kron(xy.mean(axis=0), np.ones((3, 1)))
+E, Vs = shrink_elmts(elements, vertices, shrink=0.75)
 
 AggOp = sa.levels[0].AggOp
 count = np.array(AggOp.sum(axis=0)).ravel()
@@ -3,10 +3,10 @@ import scipy.sparse as sparse
 import pyamg
 import scipy.optimize
 
-__all__ = ['one_D_helmholtz', 'min_wave']
+__all__ = ['one_D_helmholtz', 'min_wave', 'bracket_search']
 
 
-def min_wave(A, omega, x, tol=1e-5, maxiter=25):
+def min_wave(A, omega, x, tol=1e-5, maxiter=25, npts=None, direction=None):
     '''
 
     parameters
@@ -16,37 +16,82 @@ def min_wave(A, omega, x, tol=1e-5, maxiter=25):
     omega {scalar}
         Wavenumber used to discretize Helmholtz problem
     x {array}
-        1D mesh for the problem
+        1D mesh for the problem, or (n x d) array of coordinates
     tol {scalar}
         minimization tolerance
     maxit {integer}
         maximum iters for minimization algorithm
+    npts {integer}
+        if given, the number of shifts evaluated at once in an initial scan,
+        see bracket_search
+    direction {array}
+        for (n x d) coordinates x, the direction of the plane wave,
+        default is the first coordinate axis
 
     returns
     -------
     Applies minimization algorithm to find numerically lowest energy wavenumber
     for the matrix A, i.e., the omega shift that minimizes <Ac, c> / <c, c>,
-    for c = cosine((omega+shift)x)
+    for c = cosine((omega+shift)x), or c = cosine((omega+shift) x.direction)
 
     '''
 
+    x = np.asarray(x)
+    if x.ndim > 1:
+        if direction is None:
+            direction = np.eye(x.shape[1])[0]
+        x = x @ np.asarray(direction)
     x = np.ravel(x)
 
-    # Define scalar objective function, ignoring the
-    # boundaries by only considering A*c at [1:-1]
-    def obj_fcn(alpha):
-        c = np.cos((omega + alpha) * x)
-        Ac = (A * c)[1:-1]
-        return np.linalg.norm(Ac) / np.linalg.norm(c[1:-1])
+    # Define objective function for a batch of shifts, ignoring the
+    # boundaries by only considering A*c at [1:-1].  Column k of C
+    # is the cosine for shift alphas[k]; for a scalar shift, C is a vector.
+    def obj_fcn(alphas):
+        C = np.cos(np.multiply.outer(x, omega + alphas))
+        AC = (A @ C)[1:-1]
+        return np.linalg.norm(AC, axis=0) / np.linalg.norm(C[1:-1], axis=0)
 
-    (xopt, fval, ierr, numfunc) = scipy.optimize.fminbound(
-        obj_fcn, -0.99 * omega,
-        0.99 * omega, xtol=tol, maxfun=maxiter, full_output=True, disp=0)
+    return bracket_search(obj_fcn, -0.99 * omega, 0.99 * omega,
+                          tol=tol, maxiter=maxiter, npts=npts)
 
-    # print "Minimizer = %1.4f,  Function Value at Min = %1.4e\nError Flag = %d,\
-    #        Number of function evals = %d" % (xopt, fval, ierr, numfunc)
 
-    return xopt
+def bracket_search(fcn, lower, upper, tol=1e-5, maxiter=25, npts=None):
+    '''
+    Minimize a scalar function on [lower, upper] with scipy.optimize.fminbound,
+    optionally bracketing the minimum first with a vectorized scan
+
+    parameters
+    ----------
+    fcn {callable}
+        fcn(alphas) returns the objective for an array of points alphas,
+        and fcn(alpha) for a single point
+    lower, upper {scalar}
+        initial bracket
+    tol {scalar}
+        minimization tolerance (xtol of fminbound)
+    maxiter {integer}
+        maximum number of function evaluations of fminbound
+    npts {integer}
+        if given, fcn is first evaluated on npts equispaced points of
+        [lower, upper] (in one call), and fminbound is applied between the
+        two neighbors of the smallest value
+
+    returns
+    -------
+    The minimizer found.  The scan does not count towards maxiter; it costs
+    about npts evaluations, so it only pays off if the objective may have
+    several local minima in [lower, upper].
+
+    '''
+
+    if npts is not None:
+        alphas = np.linspace(lower, upper, npts)
+        k = np.argmin(fcn(alphas))
+        lower = alphas[max(k - 1, 0)]
+        upper = alphas[min(k + 1, npts - 1)]
+
+    return scipy.optimize.fminbound(fcn, lower, upper, xtol=tol, maxfun=maxiter,
+                                    disp=0)
 
 
 def one_D_helmholtz(h, omega=1.0, nplane_waves=2):
@@ -0,0 +1,79 @@
+"""Complex shifted Laplacian preconditioning for Helmholtz problems"""
+
+import numpy as np
+import scipy.sparse as sparse
+import pyamg
+
+__all__ = ['shifted_laplacian', 'shifted_laplacian_solver']
+
+
+def shifted_laplacian(A, shift=(1.0, 0.5), mass=None):
+    """
+    Complex shifted Laplacian derived from a Helmholtz operator
+
+    For A = K - k^2 M, the shifted operator is K - (alpha - i beta) k^2 M,
+    i.e., A + (1 - alpha) k^2 M + i beta k^2 M.
+
+    Parameters
+    ----------
+    A : {csr_matrix}
+        Helmholtz operator
+    shift : {tuple}
+        (alpha, beta), default (1, 0.5)
+    mass : {array, sparse matrix}
+        The term k^2 M.  If None, a lumped approximation is derived from A:
+        K annihilates constants away from Dirichlet boundaries, so that
+        -real(A 1) is the lumped k^2 M in those rows.  Rows where this is
+        negative are not shifted.
+
+    Returns
+    -------
+    Ashift : {csr_matrix}
+        Shifted operator.  The imaginary shift takes the sign of the
+        boundary damping in A (if any), so that both damp in the same sense.
+
+    """
+    alpha, beta = shift
+    A = sparse.csr_matrix(A)
+
+    if mass is None:
+        mass = -np.real(A @ np.ones(A.shape[0]))
+        mass = sparse.diags(np.maximum(mass, 0.0), format='csr')
+    elif not sparse.issparse(mass):
+        mass = sparse.diags(np.ravel(mass), format='csr')
+
+    damping = np.imag(A.diagonal()).sum()
+    sign = -1.0 if damping < 0 else 1.0
+
+    Ashift = A + ((1.0 - alpha) + sign * 1.0j * beta) * mass
+    return Ashift.tocsr()
+
+
+def shifted_laplacian_solver(A, shift=(1.0, 0.5), mass=None, **kwargs):
+    """
+    Standard SA hierarchy for the complex shifted Laplacian of A
+
+    The hierarchy approximates the shifted operator, not A, so it is meant
+    as a preconditioner for a Krylov method applied to A, e.g.
+
+    >>> ml = shifted_laplacian_solver(A)
+    >>> x = pyamg.krylov.gmres(A, b, M=ml.aspreconditioner())
+
+    Parameters
+    ----------
+    A, shift, mass
+        See shifted_laplacian
+    kwargs
+        Passed on to pyamg.smoothed_aggregation_solver.  By default, the
+        constant is used for B and symmetry is 'symmetric' (complex symmetric).
+
+    Returns
+    -------
+    ml : MultilevelSolver
+        Hierarchy for the shifted operator
+
+    """
+    Ashift = shifted_laplacian(A, shift=shift, mass=mass)
+    kwargs.setdefault('B', np.ones((A.shape[0], 1), dtype=Ashift.dtype))
+    kwargs.setdefault('symmetry', 'symmetric')
+    return pyamg.smoothed_aggregation_solver(Ashift, **kwargs)
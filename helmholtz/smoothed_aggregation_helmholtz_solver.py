@@ -2,6 +2,8 @@
 
 __docformat__ = "restructuredtext en"
 
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy
 import scipy
 from scipy.sparse import isspmatrix_csr, isspmatrix_bsr
@@ -19,9 +21,10 @@ from pyamg.aggregation.smooth import jacobi_prolongation_smoother, \
                     richardson_prolongation_smoother, energy_prolongation_smoother
 
 
-__all__ = ['smoothed_aggregation_helmholtz_solver', 'planewaves']
+__all__ = ['smoothed_aggregation_helmholtz_solver', 'smoothed_aggregation_helmholtz_sweep',
+           'planewaves']
 
-def planewaves(X, Y, omega=1.0, angles=[0.0]):
+def planewaves(X, Y, omega=1.0, angles=[0.0], dtype=float):
     """
     Generate plane waves for use in SA applied to Helmholtz problems
 
@@ -34,36 +37,35 @@ def planewaves(X, Y, omega=1.0, angles=[0.0]):
         Helmholtz wave number, Laplace(u) + omega^2 u = f
     angles : {list}
         List of angles in [0, 2 pi] from which to generate planewaves
+    dtype : {numpy.float64, numpy.float32}
+        Precision of the output.  float32 halves the memory of the returned
+        array, but the phase omega*(X cos(angle) + Y sin(angle)) then only has
+        about 7 significant digits, so only use it if omega*max(|X|,|Y|) is
+        moderate.  This only helps standalone calls: the candidates are
+        converted to the dtype of A in smoothed_aggregation_helmholtz_solver.
 
     Returns
     -------
-    Array of planewaves
+    Array of planewaves, of shape (len(X), 2*len(angles)), with columns
+    2k and 2k+1 the real and imaginary part of the planewave for angles[k]
 
     """
 
-    L = 2*len(angles)
-    dimen = max(X.shape)
-    W = numpy.zeros((L, dimen),dtype=complex)
-
-    if L == 0:
-        W = W.T.copy()
-        return W
-
-    X = numpy.ravel(X)
-    Y = numpy.ravel(Y)
-
-    #Set other columns to plane waves
-    counter = 0
-    for angle in angles:
-        K = (omega*numpy.cos(angle), omega*numpy.sin(angle))
-        wave = numpy.exp(0 + 1.0j*K[0]*X + 1.0j*K[1]*Y)
-
-        W[counter,:] = numpy.real(wave)
-        W[counter+1,:] = numpy.imag(wave)
-        counter += 2
-
-    # write W row-wise for efficiency
-    W = W.T.copy()
+    X = numpy.ravel(X).astype(dtype, copy=False)
+    Y = numpy.ravel(Y).astype(dtype, copy=False)
+    omega = numpy.ravel(omega)[0]
+    angles = numpy.asarray(angles, dtype=float)
+
+    # wave vectors K = omega (cos(angle), sin(angle)), for all angles at once
+    Kx = (omega*numpy.cos(angles)).astype(dtype)
+    Ky = (omega*numpy.sin(angles)).astype(dtype)
+    phase = numpy.multiply.outer(X, Kx)
+    phase += numpy.multiply.outer(Y, Ky)
+
+    # write real and imaginary parts directly to interleaved columns
+    W = numpy.empty((X.shape[0], 2*len(angles)), dtype=dtype)
+    numpy.cos(phase, out=W[:, 0::2])
+    numpy.sin(phase, out=W[:, 1::2])
     return W
 
 def preprocess_planewaves(planewaves, max_levels):
@@ -87,12 +89,30 @@ def unpack_arg(v):
     else:
         return v,{}
 
+
+def candidate_keys(pw):
+    # Helper function for smoothed_aggregation_solver.
+    # Splits a planewave entry into pieces that can be computed, relaxed and
+    # restricted once, and shared by all levels that use them.  Returns a
+    # list of (key, (fn, args)).  Calls to planewaves are split per angle, so
+    # that overlapping angle sets share their columns.  Other functions are
+    # keyed by the entry itself.
+
+    fn, args = unpack_arg(pw)
+    if fn is planewaves:
+        common = (id(args['X']), id(args['Y']),
+                  float(numpy.ravel(args.get('omega', 1.0))[0]),
+                  numpy.dtype(args.get('dtype', float)).str)
+        return [(('planewaves',) + common + (float(angle),), (fn, dict(args, angles=[angle])))
+                for angle in args.get('angles', [0.0])]
+    return [((id(pw),), (fn, args))]
+
 def smoothed_aggregation_helmholtz_solver(A, planewaves, use_constant=(True, {'last_level':0}),
         symmetry='symmetric', strength='symmetric', aggregate='standard',
         smooth=('energy', {'krylov': 'gmres'}),
         presmoother=('gauss_seidel_nr',{'sweep':'symmetric'}),
         postsmoother=('gauss_seidel_nr',{'sweep':'symmetric'}),
-        improve_candidates='default', max_levels = 10, max_coarse = 100, **kwargs):
+        improve_candidates='default', max_levels = 10, max_coarse = 100, keep=False, **kwargs):
 
     """
     Create a multilevel solver using Smoothed Aggregation (SA) for a 2D Helmholtz operator
@@ -113,6 +133,13 @@ def smoothed_aggregation_helmholtz_solver(A, planewaves, use_constant=(True, {'l
             Instead of a tuple, None can be used to stipulate no introduction
         of planewaves at that level.  If len(planewaves) < max_levels, the
         last entry is used to define coarser level planewaves.
+            Each function is evaluated, relaxed and restricted only once,
+        even if the same entry is used on several levels.  For planewaves,
+        this holds per angle, so that levels with overlapping angle sets
+        (with the same X, Y and omega) share the common planewaves.
+            The vectors are converted to the dtype of A before they are
+        relaxed and restricted, as the relaxation methods require, so
+        planewaves(..., dtype=numpy.float32) saves no memory here.
     use_constant : {tuple}
         Tuple of the form (bool, {'last_level':int}).  The boolean denotes
         whether to introduce the constant in B at level 0.  'last_level' denotes
@@ -160,6 +187,12 @@ def smoothed_aggregation_helmholtz_solver(A, planewaves, use_constant=(True, {'l
         Maximum number of levels to be used in the multilevel solver.
     max_coarse : {integer} : default 500
         Maximum number of variables permitted on the coarse grid.
+    keep : {bool} : default False
+        If True, the setup intermediates C (strength of connection), AggOp
+        (aggregation) and T (tentative prolongator) are kept on each level,
+        e.g., for visualization.  Otherwise, they are released as soon as
+        the next level exists, and the number of bytes released is stored in
+        ml.released_bytes.
 
     Other Parameters
     ----------------
@@ -275,30 +308,60 @@ def smoothed_aggregation_helmholtz_solver(A, planewaves, use_constant=(True, {'l
     levels[-1].A = A                            # matrix
     levels[-1].B = numpy.zeros((A.shape[0],0))  # place-holder for near-nullspace candidates
 
-    zeros_0 = numpy.zeros((levels[0].A.shape[0],), dtype=A.dtype)
+    ##
+    # Planewaves are evaluated and relaxed on the finest level only when first
+    # needed, once per key of candidate_keys (e.g., once per angle).  Restricted
+    # copies are then carried down the hierarchy, one restriction per level,
+    # for as long as a coarser level reuses the same key.
+    last_use = {}
+    for lvl, pw in enumerate(planewaves[:max_levels]):
+        if pw is not None:
+            for key, _ in candidate_keys(pw):
+                last_use[key] = lvl
+    restricted = {}
+    released_bytes = 0
+
+    ##
+    # Relaxation operators used to improve the candidates, built once per level
+    relax_ops = {}
+    def relax(lvl):
+        if lvl not in relax_ops:
+            A_l = levels[lvl].A
+            zeros_l = numpy.zeros((A_l.shape[0],), dtype=A_l.dtype)
+            relax_ops[lvl] = relaxation_as_linear_operator(improve_candidates[lvl], A_l, zeros_l)
+        return relax_ops[lvl]
+
     while len(levels) < max_levels and levels[-1].A.shape[0] > max_coarse:
         A = levels[0].A
         A_l = levels[-1].A
-        zeros_l = numpy.zeros((levels[-1].A.shape[0],), dtype=A.dtype)
 
         ##
         # Generate additions to n-th level candidates
-        if planewaves[len(levels)-1] != None:
-            fn, args = unpack_arg(planewaves[len(levels)-1])
-            Bcoarse2 = numpy.array(fn(**args))
-
-            ##
-            # As in alpha-SA, relax the candidates before restriction
-            if improve_candidates[0] is not None:
-                Bcoarse2 = relaxation_as_linear_operator(improve_candidates[0], A, zeros_0)*Bcoarse2
-
-            ##
-            # Restrict Bcoarse2 to current level
-            for i in range(len(levels)-1):
-                Bcoarse2 = levels[i].R*Bcoarse2
+        pw = planewaves[len(levels)-1]
+        if pw is not None:
+            Bcoarse2 = []
+            for key, (fn, args) in candidate_keys(pw):
+                if key not in restricted:
+                    # the relaxation and restriction work in the dtype of A,
+                    # so a lower precision block is converted here
+                    B0 = numpy.asarray(fn(**args), dtype=A.dtype)
+
+                    ##
+                    # As in alpha-SA, relax the candidates before restriction
+                    if improve_candidates[0] is not None:
+                        B0 = relax(0)*B0
+
+                    ##
+                    # Restrict B0 to current level
+                    for i in range(len(levels)-1):
+                        B0 = levels[i].R @ B0
+                    restricted[key] = B0
+                Bcoarse2.append(restricted[key])
+            Bcoarse2 = numpy.hstack(Bcoarse2)
+
             # relax after restriction
             if improve_candidates[len(levels)-1] is not None:
-                Bcoarse2 =relaxation_as_linear_operator(improve_candidates[len(levels)-1],A_l,zeros_l)*Bcoarse2
+                Bcoarse2 = relax(len(levels)-1)*Bcoarse2
         else:
             Bcoarse2 = numpy.zeros((A_l.shape[0],0),dtype=A.dtype)
 
@@ -318,9 +381,111 @@ def smoothed_aggregation_helmholtz_solver(A, planewaves, use_constant=(True, {'l
         ##
         # Create and Append new level
         _extend_hierarchy(levels, strength, aggregate, smooth, [None for i in range(max_levels)] ,keep=True)
+        if not keep:
+            released_bytes += release_setup_data(levels[-2])
+
+        ##
+        # Restrict the planewaves still needed on coarser levels
+        for key in list(restricted):
+            if last_use[key] < len(levels)-1:
+                del restricted[key]
+            else:
+                restricted[key] = levels[-2].R @ restricted[key]
 
     ml = multilevel_solver(levels, **kwargs)
+    ml.released_bytes = released_bytes
     change_smoothers(ml, presmoother, postsmoother)
     return ml
 
 
+def nbytes(M):
+    """Number of bytes held by the arrays of a sparse matrix or array M."""
+    if M is None:
+        return 0
+    if scipy.sparse.issparse(M):
+        return sum(getattr(M, a).nbytes for a in ('data', 'indices', 'indptr', 'row', 'col', 'offsets')
+                   if hasattr(M, a))
+    return numpy.asarray(M).nbytes
+
+
+def release_setup_data(level):
+    """Delete the setup intermediates C, AggOp and T from level.
+
+    Returns the number of bytes released.
+    """
+    released = 0
+    for name in ('C', 'AggOp', 'T'):
+        if hasattr(level, name):
+            released += nbytes(getattr(level, name))
+            delattr(level, name)
+    return released
+
+
+def smoothed_aggregation_helmholtz_sweep(A_list, planewaves_list, workers=1, **kwargs):
+    """
+    Create Helmholtz SA solvers for a sweep of wavenumbers on the same mesh
+
+    The strength of connection and aggregation are computed once, for the
+    first problem in A_list, and then reused as predefined strength and
+    aggregation for all other problems.  For these, only the planewave
+    candidates, the tentative and smoothed prolongators, and the coarse
+    operators are recomputed.
+
+    Parameters
+    ----------
+    A_list : {list}
+        Helmholtz operators, one per wavenumber, all on the same mesh
+        (see smoothed_aggregation_helmholtz_solver for the format)
+    planewaves_list : {list}
+        The planewaves argument of smoothed_aggregation_helmholtz_solver, one
+        per entry of A_list
+    workers : {integer}
+        Number of threads used to build the solvers for A_list[1:]
+        concurrently.  Most of the work is done in sparse matrix kernels, but
+        the speedup depends on how much of it releases the GIL.
+    kwargs
+        All other arguments are passed on to
+        smoothed_aggregation_helmholtz_solver
+
+    Returns
+    -------
+    List of multilevel_solver, one per entry of A_list
+
+    Examples
+    --------
+    >>> omegas = [10.0, 12.0, 14.0]
+    >>> A_list = [one_D_helmholtz(h, omega=w)['A'] for w in omegas]
+    >>> pw_list = [[(planewaves, {'X': X, 'Y': Y, 'omega': w, 'angles': [0.0]})]
+    ...            for w in omegas]
+    >>> mls = smoothed_aggregation_helmholtz_sweep(A_list, pw_list, workers=2)
+
+    """
+    if len(A_list) != len(planewaves_list):
+        raise ValueError('expected one planewaves argument per operator')
+
+    ml = smoothed_aggregation_helmholtz_solver(A_list[0], planewaves_list[0],
+                                               **dict(kwargs, keep=True))
+
+    ##
+    # Predefined strength and aggregation, taken from the first hierarchy
+    strength = [('predefined', {'C': lvl.C}) for lvl in ml.levels[:-1]]
+    aggregate = [('predefined', {'AggOp': lvl.AggOp}) for lvl in ml.levels[:-1]]
+    kwargs = dict(kwargs, strength=strength, aggregate=aggregate,
+                  max_levels=len(ml.levels), max_coarse=0)
+
+    if not kwargs.get('keep', False):
+        for lvl in ml.levels:
+            ml.released_bytes += release_setup_data(lvl)
+
+    def build(A_pw):
+        A, pw = A_pw
+        return smoothed_aggregation_helmholtz_solver(A, pw, **kwargs)
+
+    problems = list(zip(A_list[1:], planewaves_list[1:]))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            mls = list(executor.map(build, problems))
+    else:
+        mls = [build(p) for p in problems]
+
+    return [ml] + mls
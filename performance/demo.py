@@ -1,12 +1,42 @@
-
 """A simple performance test adopted from sciket-fem.
+
+Each phase is timed over repeated trials, after a warmup, and the median and
+interquartile range are reported.  The results are written, with a
+description of the environment, to output/performance.json and .csv, and
+the table and the plot are made from that file.  The setup of each problem
+is also broken down by stage and level (see setup_trace.py), and the
+breakdown of the largest problem is printed.
+
+Options:
+
+    --warmup k      untimed runs of each phase (default 1)
+    --repeats r     timed runs of each phase (default 3)
+    --from FILE     only make the table and the plot from a saved .json file
+    --threads N     instead of the sweep over problem sizes, run the problem
+                    with N points per direction (e.g. 40) under thread
+                    limits of 1, 2, 4, ... up to the number of cores, and
+                    report the speedup and parallel efficiency of each phase
+                    (requires threadpoolctl)
 """
-from timeit import timeit
+import os
+import sys
+
 import numpy as np
 import skfem as skf
 from skfem.models.poisson import laplace, unit_load
 import pyamg
 
+from harness import timed, level_bytes, environment, write_results, read_results
+from setup_trace import SetupTrace, table
+
+warmup = 1
+if '--warmup' in sys.argv:
+    warmup = int(sys.argv[sys.argv.index('--warmup') + 1])
+repeats = 3
+if '--repeats' in sys.argv:
+    repeats = int(sys.argv[sys.argv.index('--repeats') + 1])
+resultsfile = './output/performance'
+
 def pre(N=3):
     m = skf.MeshTet.init_tensor(*(3 * (np.linspace(0., 1., N),)))
     return m
@@ -18,52 +48,151 @@ def assembler(m):
         unit_load.assemble(basis),
     )
 
-times  = []
-fw = 11
-kmin =  6
-kmax = 20
-Nlist = [int(2 ** (k / 3)) for k in range(kmin, kmax)]
-# print(Nlist)
+phases = {'mesh': 'Mesh', 'assembly': 'Assembly', 'condense': 'Solve prep',
+          'setup': 'Solve setup', 'solve': 'Solve'}
 
-header = ['DoFs','Assembly', 'Solve prep', 'Solve setup', 'Solve']
-hline = '|'.join(["-"*(fw+2) for h in header])
-header = '|'.join([f'{h:^{fw+2}}' for h in header])
-print('|'+header+'|')
-print('|'+hline+'|')
-for N in Nlist:
-    m = pre(N)
+def pipeline(N, memory=False):
+    stats = {}
 
-    assemble_time = timeit(lambda: assembler(m), number=1)
-    A, b = assembler(m)
+    m, stats['mesh'] = timed(lambda: pre(N), warmup, repeats, memory)
+
+    (A, b), stats['assembly'] = timed(lambda: assembler(m), warmup, repeats, memory)
     D = m.boundary_nodes()
 
-    condense_time = timeit(lambda: skf.condense(A, b, D=D), number=1)
-    A, b, _, _ = skf.condense(A, b, D=D)
+    (A, b, _, _), stats['condense'] = timed(lambda: skf.condense(A, b, D=D),
+                                            warmup, repeats, memory)
+
+    # the same hierarchy (max_coarse=10) is timed and used in the solve
+    ml, stats['setup'] = timed(lambda: pyamg.smoothed_aggregation_solver(A, max_coarse=10),
+                               warmup, repeats, memory)
+
+    mlsolver = skf.solver_iter_pcg(verbose=False, M=ml.aspreconditioner(), rtol=1e-8)
+    _, stats['solve'] = timed(lambda: skf.solve(A, b, solver=mlsolver), warmup, repeats, memory)
+
+    # one more setup, broken down by stage and level, and once more for the
+    # memory of each stage, as tracing allocations distorts the times
+    with SetupTrace() as trace:
+        pyamg.smoothed_aggregation_solver(A, max_coarse=10)
+    if memory:
+        with SetupTrace(memory=True) as mtrace:
+            pyamg.smoothed_aggregation_solver(A, max_coarse=10)
+        for e, m in zip(trace.events, mtrace.events):
+            e['memory'] = m['memory']
 
-    setup_time = timeit(lambda: pyamg.smoothed_aggregation_solver(A).aspreconditioner(), number=1)
-    ml = pyamg.smoothed_aggregation_solver(A,
-                                           max_coarse=10).aspreconditioner()
+    return {'N': N, 'dofs': len(b), 'phases': stats, 'levels': level_bytes(ml),
+            'setup_trace': trace.to_dict()}
 
-    mlsolver = skf.solver_iter_pcg(verbose=False, M=ml, rtol=1e-8)
-    solve_time = timeit(lambda: skf.solve(A, b, solver=mlsolver), number=1)
+if '--threads' in sys.argv:
+    from threadpoolctl import threadpool_limits
 
-    times.append([len(b), assemble_time, condense_time, setup_time, solve_time])
-    print(f'| {len(b):>{fw}d} | {assemble_time:>{fw}.5f} | {condense_time:{fw}.5f} | {setup_time:{fw}.5f} | {solve_time:{fw}.5f} |')
+    N = int(sys.argv[sys.argv.index('--threads') + 1])
+    ncores = os.cpu_count()
+    threads = [2**k for k in range(ncores.bit_length()) if 2**k < ncores] + [ncores]
+
+    results = []
+    for p in threads:
+        with threadpool_limits(limits=p):
+            r = pipeline(N)
+        r['threads'] = p
+        results.append(r)
+
+    env = environment()
+    write_results('./output/threads', results, env)
+    results, env = read_results('./output/threads.json')
+
+    fw = 9
+    print(f"{env['cpu']}, {env['cpu_count']} cores, pyamg {env['versions']['pyamg']}")
+    print(f"{results[0]['dofs']} DoFs, median time (s) / speedup / efficiency")
+    header = ['Threads'] + list(phases.values())
+    hline = '|'.join(["-"*(fw+2)] + ["-"*(3*fw+4) for h in header[1:]])
+    header = '|'.join([f'{header[0]:^{fw+2}}'] + [f'{h:^{3*fw+4}}' for h in header[1:]])
+    print('|'+header+'|')
+    print('|'+hline+'|')
+    for r in results:
+        row = []
+        for ph in phases:
+            t1 = results[0]['phases'][ph]['median']
+            tp = r['phases'][ph]['median']
+            speedup = t1 / tp
+            row.append(f'{tp:{fw}.5f} {speedup:{fw}.2f} {speedup / r["threads"]:{fw}.2f}')
+        print(f"| {r['threads']:>{fw}d} | " + ' | '.join(row) + ' |')
+    sys.exit()
+
+if '--from' in sys.argv:
+    results, env = read_results(sys.argv[sys.argv.index('--from') + 1])
+else:
+    kmin =  6
+    kmax = 20
+    Nlist = [int(2 ** (k / 3)) for k in range(kmin, kmax)]
+
+    results = [pipeline(N, memory=True) for N in Nlist]
+
+    env = environment()
+    write_results(resultsfile, results, env)
+    results, env = read_results(resultsfile + '.json')
+
+fw = 11
+print(f"{env['cpu']}, {env['cpu_count']} cores, pyamg {env['versions']['pyamg']}")
+print(f"median time (s) of {len(results[0]['phases']['setup']['times'])} runs")
+header = ['DoFs'] + list(phases.values())
+hline = '|'.join(["-"*(fw+2) for h in header])
+header = '|'.join([f'{h:^{fw+2}}' for h in header])
+print('|'+header+'|')
+print('|'+hline+'|')
+for r in results:
+    row = ' | '.join(f"{r['phases'][p]['median']:{fw}.5f}" for p in phases)
+    print(f"| {r['dofs']:>{fw}d} | {row} |")
+
+# peak memory of each phase (traced allocations), and the storage of the
+# hierarchy summed over all levels
+if 'memory' in results[0]['phases']['setup']:
+    MB = 1024**2
+    print('\npeak memory (MB) of each phase, and bytes held by the hierarchy')
+    header = ['DoFs'] + list(phases.values()) + ['A', 'P', 'R', 'B']
+    hline = '|'.join(["-"*(fw+2) for h in header])
+    header = '|'.join([f'{h:^{fw+2}}' for h in header])
+    print('|'+header+'|')
+    print('|'+hline+'|')
+    for r in results:
+        row = [r['phases'][p]['memory']['traced'] / MB for p in phases]
+        row += [sum(lvl[name] for lvl in r['levels']) / MB for name in 'APRB']
+        row = ' | '.join(f'{v:{fw}.3f}' for v in row)
+        print(f"| {r['dofs']:>{fw}d} | {row} |")
+
+# setup of the largest problem by stage and level
+if 'setup_trace' in results[-1]:
+    print(f"\nsetup of the largest problem ({results[-1]['dofs']} DoFs)")
+    print(table(results[-1]['setup_trace']['events'], results[-1]['setup_trace']['total']))
 
 import matplotlib.pyplot as plt
-fig, ax = plt.subplots()
-n = [t[0] for t in times]
-ax.loglog(n, [t[1] for t in times], label='Assembly')
-ax.loglog(n, [t[2] for t in times], label='Solve prep')
-ax.loglog(n, [t[3] for t in times], label='Solve setup')
-ax.loglog(n, [t[4] for t in times], label='Solve')
+fig, axs = plt.subplots(ncols=2, figsize=(10, 4))
+ax = axs[0]
+n = [r['dofs'] for r in results]
+for p, label in phases.items():
+    median = np.array([r['phases'][p]['median'] for r in results])
+    q1 = np.array([r['phases'][p]['q1'] for r in results])
+    q3 = np.array([r['phases'][p]['q3'] for r in results])
+    ax.loglog(n, median, label=label)
+    ax.fill_between(n, q1, q3, alpha=0.3)
 ax.set_xlabel('# DoFs')
 ax.set_ylabel('time (s)')
 ax.grid(True)
-plt.legend()
+ax.legend()
+
+ax = axs[1]
+if 'memory' in results[0]['phases']['setup']:
+    for p, label in phases.items():
+        ax.loglog(n, [r['phases'][p]['memory']['traced'] for r in results],
+                  label=f'{label} (peak)')
+    for name in 'APRB':
+        ax.loglog(n, [sum(lvl[name] for lvl in r['levels']) for r in results], '--',
+                  label=f'hierarchy {name}')
+    ax.set_xlabel('# DoFs')
+    ax.set_ylabel('memory (bytes)')
+    ax.grid(True)
+    ax.legend(fontsize='small')
 
 figname = f'./output/performance.png'
-import sys
 if '--savefig' in sys.argv:
     plt.savefig(figname, bbox_inches='tight', dpi=150)
 else:
@@ -0,0 +1,242 @@
+"""Timing harness for the performance example
+
+Each phase is run a few times without timing (warmup), and then timed over
+repeated trials.  Optionally, the peak memory of the first warmup run is
+recorded, both as traced allocations (tracemalloc) and as the growth of the
+resident set size (RSS) of the process.  The object returned by the last timed trial is kept, so
+that the next phase uses exactly what was timed.  Results are written to a
+JSON file (and a flat CSV file) together with a description of the
+environment, and the table and plot of the example are made from that file.
+"""
+import csv
+import json
+import os
+import platform
+import sys
+import threading
+import tracemalloc
+from importlib.metadata import version, PackageNotFoundError
+from time import perf_counter
+
+import scipy.sparse as sparse
+
+import numpy as np
+
+__all__ = ['timed', 'summarize', 'peak_memory', 'level_bytes', 'environment',
+           'write_results', 'read_results']
+
+
+def timed(fn, warmup=1, repeats=5, memory=False):
+    """
+    Time fn() over repeated trials
+
+    Parameters
+    ----------
+    fn : callable
+        Function without arguments
+    warmup : int
+        Number of untimed calls before the trials
+    repeats : int
+        Number of timed calls
+    memory : bool
+        If True, the peak memory of the first warmup call (or of an extra
+        untimed call if warmup is 0) is recorded in stats['memory'], see
+        peak_memory.  Tracing allocations slows that call down, so it is
+        never one of the timed calls.
+
+    Returns
+    -------
+    value : object
+        Return value of the last timed call
+    stats : dict
+        Timings of the trials, see summarize
+    """
+    mem = None
+    if memory:
+        _, mem = peak_memory(fn)
+        warmup -= 1
+    for _ in range(warmup):
+        fn()
+    times = []
+    value = None
+    for _ in range(repeats):
+        value = None    # release the previous value before the next trial
+        tic = perf_counter()
+        value = fn()
+        times.append(perf_counter() - tic)
+    stats = summarize(times)
+    if mem is not None:
+        stats['memory'] = mem
+    return value, stats
+
+
+def summarize(times):
+    """Median, quartiles and interquartile range of a list of timings."""
+    q1, median, q3 = np.percentile(times, [25, 50, 75])
+    return {'times': list(times), 'median': median, 'q1': q1, 'q3': q3,
+            'iqr': q3 - q1}
+
+
+def peak_memory(fn, interval=1e-3):
+    """
+    Peak memory of one call of fn()
+
+    Parameters
+    ----------
+    fn : callable
+        Function without arguments
+    interval : float
+        Sampling interval (s) of the resident set size
+
+    Returns
+    -------
+    value : object
+        Return value of fn()
+    memory : dict
+        'traced' is the peak of the memory allocated through Python (including
+        numpy arrays) during the call, and 'rss' the peak growth of the
+        resident set size over its value before the call (None if
+        /proc/self/statm is not available), both in bytes
+    """
+    sampler = _RSSSampler(interval)
+    tracemalloc.start()
+    try:
+        with sampler:
+            value = fn()
+        traced = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return value, {'traced': traced, 'rss': sampler.peak}
+
+
+class _RSSSampler:
+    # Samples the resident set size in a background thread, and keeps the
+    # largest growth over the first sample
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def rss():
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError):
+            return None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        rss = self.rss()
+        if rss is not None:
+            self.peak = max(self.peak, rss - self.start)
+
+    def __enter__(self):
+        self.start = self.rss()
+        if self.start is not None:
+            self.peak = 0
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+
+
+def _nbytes(M):
+    # bytes held by the arrays of a sparse matrix or an array
+    if M is None:
+        return 0
+    if sparse.issparse(M):
+        return sum(getattr(M, a).nbytes for a in ('data', 'indices', 'indptr')
+                   if hasattr(M, a))
+    return np.asarray(M).nbytes
+
+
+def level_bytes(ml):
+    """Bytes held by A, P, R and B on each level of a multilevel solver."""
+    return [{name: _nbytes(getattr(lvl, name, None)) for name in ('A', 'P', 'R', 'B')}
+            for lvl in ml.levels]
+
+
+def environment():
+    """Description of the machine, thread settings and library versions."""
+    env = {'python': sys.version.split()[0],
+           'platform': platform.platform(),
+           'machine': platform.machine(),
+           'cpu': _cpu_model(),
+           'cpu_count': os.cpu_count(),
+           'versions': {},
+           'thread_variables': {},
+           'threadpools': []}
+    for name in ('numpy', 'scipy', 'pyamg', 'scikit-fem'):
+        try:
+            env['versions'][name] = version(name)
+        except PackageNotFoundError:
+            env['versions'][name] = None
+    for var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        env['thread_variables'][var] = os.environ.get(var)
+    try:
+        from threadpoolctl import threadpool_info
+        env['threadpools'] = [{key: pool.get(key) for key in
+                               ('user_api', 'internal_api', 'num_threads', 'version')}
+                              for pool in threadpool_info()]
+    except ImportError:
+        pass
+    return env
+
+
+def _cpu_model():
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor()
+
+
+def write_results(fname, results, env):
+    """
+    Write results to fname.json, and a flat table to fname.csv
+
+    Parameters
+    ----------
+    fname : str
+        File name without extension
+    results : list
+        One dict per problem size, with the number of unknowns in 'dofs' and
+        the statistics (see summarize) of each phase in 'phases', and
+        optionally other (JSON) entries, e.g., 'levels' from level_bytes
+    env : dict
+        See environment
+    """
+    with open(fname + '.json', 'w') as f:
+        json.dump({'environment': env, 'results': results}, f, indent=1)
+
+    columns = ['dofs', 'phase', 'median', 'q1', 'q3', 'iqr', 'repeats',
+               'traced_peak', 'rss_peak']
+    with open(fname + '.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for r in results:
+            for phase, stats in r['phases'].items():
+                mem = stats.get('memory', {})
+                writer.writerow([r['dofs'], phase, stats['median'], stats['q1'],
+                                 stats['q3'], stats['iqr'], len(stats['times']),
+                                 mem.get('traced'), mem.get('rss')])
+
+
+def read_results(fname):
+    """Read a JSON file written by write_results; returns (results, env)."""
+    with open(fname) as f:
+        data = json.load(f)
+    return data['results'], data['environment']
@@ -0,0 +1 @@
+../util/setup_trace.py
\ No newline at end of file
@@ -0,0 +1,248 @@
+"""Profiles of the setup and the solve of AMG on gallery problems
+
+The setup and the solve are profiled separately with pyinstrument, and each
+profile is written in three formats:
+
+    fname.pyisession       pyinstrument session, e.g., for
+                           `pyinstrument --load fname.pyisession -r html`
+    fname.speedscope.json  for https://www.speedscope.app
+    fname.collapsed        collapsed stacks, one `frame;frame;... microseconds`
+                           line per stack, e.g., for flamegraph.pl
+
+Two collapsed-stack files (e.g., before and after a pyamg upgrade, or SA and
+rootnode) are compared by the share of the total time spent in each
+function, so that profiles of different length can be compared.  Frames
+are named `function (file)`, without line numbers, so that a function is
+matched across versions.
+"""
+from collections import defaultdict
+
+import numpy as np
+import pyamg
+from pyinstrument import Profiler
+from pyinstrument.renderers import SpeedscopeRenderer
+
+__all__ = ['problems', 'solvers', 'gallery_problem', 'profile_solver',
+           'collapsed_stacks', 'write_profile', 'read_collapsed',
+           'function_shares', 'diff_profiles', 'diff_table']
+
+problems = ['poisson2d', 'poisson3d', 'anisotropic', 'elasticity']
+solvers = {'sa': pyamg.smoothed_aggregation_solver,
+           'rootnode': pyamg.rootnode_solver,
+           'rs': pyamg.ruge_stuben_solver}
+
+
+def gallery_problem(name, n):
+    """
+    Matrix (and near null space) of a pyamg.gallery problem
+
+    Parameters
+    ----------
+    name : str
+        One of problems: 'poisson2d' and 'poisson3d' (n points per
+        direction), 'anisotropic' (rotated anisotropic diffusion, n x n) or
+        'elasticity' (2D linear elasticity, n x n)
+    n : int
+        Points per direction
+
+    Returns
+    -------
+    A : csr_matrix or bsr_matrix
+    B : array or None
+        Near null space, if not the constant
+    """
+    if name == 'poisson2d':
+        return pyamg.gallery.poisson((n, n), format='csr'), None
+    if name == 'poisson3d':
+        return pyamg.gallery.poisson((n, n, n), format='csr'), None
+    if name == 'anisotropic':
+        stencil = pyamg.gallery.diffusion_stencil_2d(type='FE', epsilon=0.001,
+                                                     theta=np.pi / 8)
+        return pyamg.gallery.stencil_grid(stencil, (n, n), format='csr'), None
+    if name == 'elasticity':
+        return pyamg.gallery.linear_elasticity((n, n), format='bsr')
+    raise ValueError(f'unknown problem {name}, choose from {problems}')
+
+
+def _profiled(fn, *args, **kwargs):
+    # the stacks of the written profiles start below this frame
+    return fn(*args, **kwargs)
+
+
+def profile_solver(A, B=None, solver='sa', interval=1e-3, **kwargs):
+    """
+    Profile the setup and the solve of a solver
+
+    Parameters
+    ----------
+    A : sparse matrix
+        Matrix
+    B : array
+        Near null space, passed to the setup if not None
+    solver : str
+        Key of solvers
+    interval : float
+        Sampling interval (s)
+    kwargs
+        Passed on to the setup
+
+    Returns
+    -------
+    ml : MultilevelSolver
+        Hierarchy
+    sessions : dict
+        pyinstrument sessions of the 'setup' and the 'solve'
+    """
+    if B is not None:
+        kwargs['B'] = B
+    if solver not in solvers:
+        raise ValueError(f'unknown solver {solver}, choose from {list(solvers)}')
+
+    sessions = {}
+    profiler = Profiler(interval=interval)
+    profiler.start()
+    ml = _profiled(solvers[solver], A, **kwargs)
+    sessions['setup'] = profiler.stop()
+
+    np.random.seed(2024)
+    b = np.random.rand(A.shape[0])
+    profiler = Profiler(interval=interval)
+    profiler.start()
+    _profiled(ml.solve, b, tol=1e-8)
+    sessions['solve'] = profiler.stop()
+    return ml, sessions
+
+
+def _name(frame):
+    return f'{frame.function} ({frame.file_path_short})'
+
+
+def collapsed_stacks(session):
+    """
+    Self time of each stack of a session
+
+    Returns
+    -------
+    dict
+        {'frame;frame;...': microseconds}, for the stacks below the
+        profiled call (see profile_solver), or of the whole session
+    """
+    roots = [session.root_frame()]
+    # descend to the profiled call, if there is one
+    stack = list(roots)
+    while stack:
+        frame = stack.pop()
+        if frame.function == '_profiled':
+            roots = [c for c in frame.children if not c.is_synthetic_leaf]
+            break
+        stack.extend(frame.children)
+
+    stacks = defaultdict(int)
+
+    def walk(frame, prefix):
+        # the self time of a frame is held by its synthetic [self] children
+        name = prefix + [_name(frame)]
+        children = [c for c in frame.children if not c.is_synthetic_leaf]
+        self_time = frame.time - sum(c.time for c in children)
+        if round(self_time * 1e6) > 0:
+            stacks[';'.join(name)] += round(self_time * 1e6)
+        for c in children:
+            walk(c, name)
+
+    for root in roots:
+        walk(root, [])
+    return dict(stacks)
+
+
+def write_profile(session, fname):
+    """Write a session to fname.pyisession, .speedscope.json and .collapsed."""
+    session.save(fname + '.pyisession')
+    with open(fname + '.speedscope.json', 'w') as f:
+        f.write(SpeedscopeRenderer().render(session))
+    with open(fname + '.collapsed', 'w') as f:
+        for stack, us in collapsed_stacks(session).items():
+            f.write(f'{stack} {us}\n')
+
+
+def read_collapsed(fname):
+    """Read a collapsed-stack file; returns {stack: count}."""
+    stacks = defaultdict(int)
+    with open(fname) as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks[stack] += int(count)
+    return dict(stacks)
+
+
+def function_shares(stacks):
+    """
+    Share of the total time spent in each function
+
+    Parameters
+    ----------
+    stacks : dict
+        See collapsed_stacks
+
+    Returns
+    -------
+    total : int
+        Total of the stacks
+    self_share : dict
+        {function: share of the time spent in the function itself}
+    total_share : dict
+        {function: share of the time spent in the function and its callees},
+        counting recursive calls once
+    """
+    total = sum(stacks.values())
+    self_share = defaultdict(float)
+    total_share = defaultdict(float)
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        self_share[frames[-1]] += count / total
+        for frame in set(frames):
+            total_share[frame] += count / total
+    return total, dict(self_share), dict(total_share)
+
+
+def diff_profiles(before, after):
+    """
+    Change of the share of time of each function from one profile to another
+
+    Parameters
+    ----------
+    before, after : dict
+        See collapsed_stacks or read_collapsed
+
+    Returns
+    -------
+    totals : tuple
+        Total time of both profiles
+    rows : list
+        (function, self share before, self share after, total share
+        before, total share after), sorted by the growth of the self share
+    """
+    total_a, self_a, incl_a = function_shares(before)
+    total_b, self_b, incl_b = function_shares(after)
+    rows = [(fn, self_a.get(fn, 0.0), self_b.get(fn, 0.0),
+             incl_a.get(fn, 0.0), incl_b.get(fn, 0.0))
+            for fn in set(incl_a) | set(incl_b)]
+    rows.sort(key=lambda r: r[2] - r[1], reverse=True)
+    return (total_a, total_b), rows
+
+
+def diff_table(totals, rows, top=15, fw=9):
+    """Table of the functions whose self share of time grew the most."""
+    header = ['Self %', 'Change', 'Total %', 'Change']
+    hline = '|'.join(["-"*(fw+2) for h in header] + ['-'*60])
+    header = '|'.join([f'{h:^{fw+2}}' for h in header] + [f"{'Function':^60}"])
+    out = [f'total {totals[0] / 1e6:.4f} s before, {totals[1] / 1e6:.4f} s after',
+           'functions whose share of the time grew (% of the total)',
+           '|'+header+'|', '|'+hline+'|']
+    for fn, sa, sb, ta, tb in rows[:top]:
+        if sb <= sa:
+            break
+        out.append(f'| {100 * sb:{fw}.2f} | {100 * (sb - sa):+{fw}.2f} '
+                   f'| {100 * tb:{fw}.2f} | {100 * (tb - ta):+{fw}.2f} '
+                   f'| {fn[:58]:<58} |')
+    return '\n'.join(out)
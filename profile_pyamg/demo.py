@@ -1,17 +1,74 @@
-from pyinstrument import Profiler
+"""Profile the setup and the solve of AMG
+
+Options:
+
+    --problem NAME  gallery problem: poisson2d (default), poisson3d,
+                    anisotropic or elasticity
+    --n N           points per direction (default 1000)
+    --solver NAME   sa (default), rootnode or rs
+    --output NAME   prefix of the profiles (default
+                    output/<problem>_<n>_<solver>), written to
+                    NAME_setup.* and NAME_solve.*
+    --trace FILE    also write the setup trace to FILE (JSON)
+    --diff A B      only compare two .collapsed profiles, e.g.,
+                    output/poisson2d_1000_sa_setup.collapsed and
+                    output/poisson2d_1000_rootnode_setup.collapsed
+"""
+import os
+import sys
 
 import numpy as np
-import pyamg
+from pyinstrument.renderers import ConsoleRenderer
+
+from amg_profile import solvers, gallery_problem, profile_solver, write_profile, \
+    read_collapsed, diff_profiles, diff_table
+from setup_trace import SetupTrace
+from solve_trace import SolveTrace
 
+if '--diff' in sys.argv:
+    i = sys.argv.index('--diff')
+    before, after = sys.argv[i + 1], sys.argv[i + 2]
+    print(f'{before} -> {after}')
+    print(diff_table(*diff_profiles(read_collapsed(before), read_collapsed(after))))
+    sys.exit()
+
+problem = 'poisson2d'
+if '--problem' in sys.argv:
+    problem = sys.argv[sys.argv.index('--problem') + 1]
 n = int(1e3)
-A = pyamg.gallery.poisson((n, n), format='csr')
-b = np.random.rand(A.shape[0])
+if '--n' in sys.argv:
+    n = int(sys.argv[sys.argv.index('--n') + 1])
+solver = 'sa'
+if '--solver' in sys.argv:
+    solver = sys.argv[sys.argv.index('--solver') + 1]
+output = f'./output/{problem}_{n}_{solver}'
+if '--output' in sys.argv:
+    output = sys.argv[sys.argv.index('--output') + 1]
 
-profiler = Profiler()
-profiler.start()
-ml = pyamg.smoothed_aggregation_solver(A, max_coarse=10)
-profiler.stop()
+A, B = gallery_problem(problem, n)
 
-x = ml.solve(b)
+ml, sessions = profile_solver(A, B, solver=solver, max_coarse=10)
+
+os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+for phase, session in sessions.items():
+    write_profile(session, f'{output}_{phase}')
+    print(f'{phase}: {session.duration:.4f} s, written to {output}_{phase}.*')
+
+print(ConsoleRenderer(unicode=True, color=True).render(sessions['setup']))
+
+# the solve, by stage and level
+np.random.seed(2024)
+b = np.random.rand(A.shape[0])
+with SolveTrace(ml) as solve_trace:
+    x = ml.solve(b, tol=1e-8)
+print(solve_trace.table())
+print()
 
-print(profiler.output_text(unicode=True, color=True))
+# the setup, by stage and level (for the aggregation-based solvers)
+if solver != 'rs':
+    kwargs = {} if B is None else {'B': B}
+    with SetupTrace(memory=True) as trace:
+        ml = solvers[solver](A, max_coarse=10, **kwargs)
+    print(trace.table())
+    if '--trace' in sys.argv:
+        trace.write(sys.argv[sys.argv.index('--trace') + 1])
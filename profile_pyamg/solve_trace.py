@@ -0,0 +1 @@
+../util/solve_trace.py
\ No newline at end of file
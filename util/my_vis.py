@@ -12,18 +12,27 @@ __docformat__ = "restructuredtext en"
 
 
 import warnings
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 import numpy as np
 
-from scipy.spatial import Delaunay
-from scipy import array, zeros, mean, kron, ones, sparse, rand
+from scipy.spatial import Delaunay, QhullError
+from numpy.random import rand
+from scipy import sparse
 from scipy.sparse import csr_matrix, coo_matrix, csc_matrix
 from os import system
 
 import pyamg
 import pyamg.vis
 
-__all__ = ['my_vis', 'shrink_elmts', 'dg_vis']
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+__all__ = ['my_vis', 'shrink_elmts', 'dg_vis', 'aggregate_cells', 'write_vtu', 'write_xdmf']
 
 
 def shrink_elmts(E2V, Vert, shrink=0.75):
@@ -44,67 +53,40 @@ def shrink_elmts(E2V, Vert, shrink=0.75):
     -------
     Vert and E2V with Vert appropriately scaled
 
+    Notes
+    -----
+    The barycenter is that of the first D+1 nodes of each element (the
+    vertices of the simplex), and all nodes of the element, including higher
+    order nodes, are moved towards it.  Vertices should not be shared between
+    elements (as in a discontinuous Galerkin mesh), otherwise a shared vertex
+    is moved towards the barycenter of only one of its elements.
+
     """
-    E2V = array(E2V)
-    Vert = array(Vert)
-    Nelnodes = E2V.shape[1]
-    Nel = E2V.shape[0]
+    E2V = np.asarray(E2V)
+    Vert = np.array(Vert, dtype=float)
 
-    if(Vert.shape[1] == 2):
+    if (Vert.shape[1] == 2) or not Vert[:, 2].any():
+        # Assume 2D if last column of Vert is all zero
         Dimen = 2
-        # Determine if polynomial order is greater than 1
-        if(Nelnodes > 3):
-            nonlin = True
-            num_non_verts = Nelnodes - 3
-        else:
-            nonlin = False
-    elif(Vert[:, 2].nonzero()[0].shape[0] == 0):  # Assume 2D if last column of Vert is all zero
-        Dimen = 2
-        # Determine if polynomial order is greater than 1
-        if(Nelnodes > 3):
-            nonlin = True
-            num_non_verts = Nelnodes - 3
-        else:
-            nonlin = False
     else:
         Dimen = 3
-        # Determine if polynomial order of basis functions is greater than 1
-        if(Nelnodes > 4):
-            nonlin = True
-            num_non_verts = Nelnodes - 4
-        else:
-            nonlin = False
 
-    # Account for shared faces, for case that this is used to shrink a cont Gal mesh
-    # Vert = Vert[E2V.flatten(),:]
-    # Agg = Agg[E2V.flatten(),:]
-    # E2V = array(range(Vert.shape[0])).reshape(Vert.shape[0]/Nelnodes, Nelnodes)
-    # Nel = E2V.shape[0]
+    # gather the nodes of all elements, (Nel x Nelnodes x D)
+    verts = Vert[E2V]
 
-    # Store Barycenter for each element
-    Bcenter = zeros((Nel, Vert.shape[1]))
+    # barycenters, assuming the first Dimen+1 nodes are the simplex vertices
+    Bcenter = verts[:, 0:(Dimen + 1), :].mean(axis=1, keepdims=True)
 
-    for i in range(Nel):
-        # Assumes first Dimen+1 nodes are verts for the simplex
-        verts_K = Vert[E2V[i, 0:(Dimen + 1)], :]
-
-        # Calculate Barycenter of element i
-        Bcenter[i, :] = mean(verts_K, 0)
-
-        # Shift vertices to barycenter
-        Vert[E2V[i, 0:Dimen + 1], :] = shrink * verts_K + \
-            (1 - shrink) * kron(Bcenter[i, :], ones((Dimen + 1, 1)))
-
-        if(nonlin):
-            # Move non-vertices to barycenter with the same formula, namely
-            #    shrink*point_barycoords + (1-shrink)*barycenter.
-            Vert[E2V[i, (Dimen + 1):], :] = shrink * (Vert[E2V[i, (Dimen + 1):], :]) + \
-                (1 - shrink) * kron(Bcenter[i, :], ones((num_non_verts, 1)))
+    # move all nodes towards the barycenter,
+    #    shrink*point + (1-shrink)*barycenter
+    verts *= shrink
+    verts += (1 - shrink) * Bcenter
+    Vert[E2V] = verts
 
     return E2V, Vert
 
 
-def dg_vis(fname, Vert, E2V, Agg, mesh_type, A=None):
+def dg_vis(fname, Vert, E2V, Agg, mesh_type, A=None, encoding='ascii'):
     """Coarse grid visualization for 2-D discontinuous Galerkin Problems, for use with Paraview
 
     Parameters
@@ -121,6 +103,8 @@ def dg_vis(fname, Vert, E2V, Agg, mesh_type, A=None):
         type of elements: tri
     A : {sparse amtrix}
         optional, used for better coloring
+    encoding : {'ascii', 'raw', 'zlib'}
+        format of the data arrays, see write_vtu
 
     Returns
     -------
@@ -169,111 +153,208 @@ def dg_vis(fname, Vert, E2V, Agg, mesh_type, A=None):
     # plot_type = 'vertex' output to .vtu --- throw point list down on mesh,
     # so E2V becomes Nx1 array
     filename = fname + "_point-aggs.vtu"
-    if False:  # A is not None:
-        # color aggregates with vertex coloring
-        G = Agg.T * abs(A) * Agg
-        colors = pyamg.graph.vertex_coloring(G, method='LDF')
-        pdata = Agg * colors  # extend aggregate colors to vertices
-    else:
-        # color aggregates in sequence
-        Agg = coo_matrix(Agg)
-        pdata = zeros(Ndof)
-        colors = array(range(Agg.shape[1])) % Ncolors
-        pdata[Agg.row] = Agg.col % Ncolors
-
-    pyamg.vis.write_basic_mesh(
-        Vert,
-        E2V=array(range(N)).reshape(N, 1),
-        mesh_type='vertex',
+    # color aggregates in sequence
+    Agg = coo_matrix(Agg)
+    pdata = np.zeros(Ndof)
+    pdata[Agg.row] = Agg.col % Ncolors
+
+    write_vtu(
+        V=Vert,
+        cells={1: np.arange(N).reshape(N, 1)},
         pdata=pdata,
-        fname=filename)
+        fname=filename,
+        encoding=encoding)
 
-    # plot_type = 'primal', using a global Delaunay triangulation of the shrunken mesh,
-    #   we visualize the aggregates as if the global Delaunay triangulation defined a continuous Galerkin
-    #   mesh upon which our aggregates are defined.
-    # tri_pts = Delaunay(Vert[:,0:2]).simplices
-    # coarse_grid_vis(filename, Vert, tri_pts, Agg, A=A, plot_type='primal', mesh_type='tri')
+    # Triangulate each aggregate, and throw the triangles down as elements in
+    # a new mesh.  Aggregates of two dofs are drawn as a line.
     filename = fname + "_aggs.vtu"
+    lines, line_aggs, tris, tri_aggs = aggregate_cells(Vert, Agg)
 
-    # Do a local Delaunay triangulation for each aggregate, and throw that
-    # down as an element in a new mesh
-    Agg = csc_matrix(Agg)
-    E2Vnew = zeros((0,), dtype=int)
-    colors_new = zeros((0,), dtype=int)
-    for i in range(Agg.shape[1]):
-        rowstart = Agg.indptr[i]
-        rowend = Agg.indptr[i + 1]
-        # The nonzeros in column i of Agg define the dofs in Agg i
-        members = Agg.indices[rowstart:rowend]
-        if max(members.shape) > 2:
-            tri_pts = Delaunay(Vert[members, 0:2]).simplices
-            # if i == 0:
-            #    E2Vnew = ravel(members[ravel(tri_pts)])
-            #    colors_new = ravel(repeat(colors[i], tri_pts.shape[0]))
-            # else:
-            E2Vnew = np.hstack((E2Vnew, np.ravel(members[np.ravel(tri_pts)])))
-            colors_new = np.hstack(
-                (colors_new, np.ravel(np.repeat(colors[i], tri_pts.shape[0]))))
-
-        if max(members.shape) == 2:
-            # create a dummy element, so that only a line is drawn between these two points in paraview
-            # if i == 0:
-            #    E2Vnew = array([0,members[0],members[1]])
-            #    colors_new = array([colors[i]])
-            # else:
-            E2Vnew = np.hstack((E2Vnew, array([0, members[0], members[1]])))
-            colors_new = np.hstack((colors_new, colors[i]))
-
-    # Begin Primal plotting
-    E2V = E2Vnew.reshape(-1, 3)
-    Agg = csr_matrix(Agg)
-
-    if E2V.max() >= Agg.shape[0]:
-        # remove elements with Dirichlet BCs
-        E2V = E2V[E2V.max(axis=1) < Agg.shape[0]]
-
-    # Find elements with all vertices in same aggregate
-    if len(Agg.indices) != Agg.shape[0]:
-        # account for 0 rows.  Mark them as solitary aggregates
-        full_aggs = array(Agg.sum(axis=1), dtype=int).ravel()
-        full_aggs[full_aggs == 1] = Agg.indices
-        full_aggs[full_aggs == 0] = Agg.shape[1] + \
-            np.arange(0, Agg.shape[0] - Agg.nnz, dtype=int).ravel()
-        ElementAggs = full_aggs[E2V]
-    else:
-        ElementAggs = Agg.indices[E2V]
+    Cells = {3: lines, 5: tris}
+    cdata = {3: line_aggs % Ncolors, 5: tri_aggs % Ncolors}
 
-    # mask[i] == True if all vertices in element i belong to the same aggregate
-    mask = (ElementAggs[:, :-1] == ElementAggs[:, 1:]).all(axis=1)
-    E2V3 = E2V[mask, :]
+    write_vtu(
+        V=Vert,
+        cells=Cells,
+        pdata=None,
+        cdata=cdata,
+        fname=filename,
+        encoding=encoding)
 
-    # 3 edges = 4 nodes.  Find where the difference is 0 (bdy edge)
-    markedges = np.diff(np.c_[ElementAggs, ElementAggs[:, 0]])
-    markedges[mask, :] = 1
-    markedelements, markededges = np.where(markedges == 0)
 
-    # now concatenate the edges (i.e. first and next one (mod 3 index)
-    E2V2 = np.c_[[E2V[markedelements, markededges],
-                 E2V[markedelements, (markededges + 1) % 3]]].T
+def aggregate_cells(Vert, Agg):
+    """Lines and triangles that cover the aggregates of a 2-D point set
 
-    # 2*ones((1,Nel2))  # color edges with twos
-    colors2 = colors_new[markedelements]
-    # 3*ones((1,Nel3))  # color triangles with threes
-    colors3 = colors_new[mask]
+    Aggregates of two points become a line, and larger aggregates are split
+    into the triangles of a Delaunay triangulation of their own.  The
+    triangles are written into preallocated arrays (a triangulation of n
+    points has at most 2 n - 5 triangles), ordered by aggregate.
 
-    Cells = {3: E2V2, 5: E2V3}
-    cdata = {3: colors2, 5: colors3}
+    Parameters
+    ----------
+    Vert : {array}
+        coordinate array (N x D), only the first two coordinates are used
+    Agg : {sparse matrix}
+        aggregate-vertex relationship (N x Nagg)
 
-    pyamg.vis.write_vtu(
-        V=Vert,
-        cells=Cells,
-        pdata=None,
-        cdata=cdata,
-        pvdata=None,
-        fname=filename)
+    Returns
+    -------
+    lines : {array}
+        (Nlines x 2) point indices of the lines
+    line_aggs : {array}
+        aggregate of each line
+    tris : {array}
+        (Ntris x 3) point indices of the triangles
+    tri_aggs : {array}
+        aggregate of each triangle
+    """
+    Agg = csc_matrix(Agg)
+    Agg.sort_indices()
+    sizes = np.diff(Agg.indptr)
+    XY = np.asarray(Vert)[:, 0:2]
+
+    aggs = np.flatnonzero(sizes == 2)
+    lines = Agg.indices[Agg.indptr[aggs][:, None] + np.arange(2)]
+    line_aggs = aggs
+
+    aggs = np.flatnonzero(sizes > 2)
+    size = (2 * sizes[aggs] - 5).sum()
+    tris = np.empty((size, 3), dtype=Agg.indices.dtype)
+    tri_aggs = np.empty(size, dtype=int)
+    ntris = 0
+    for i in aggs:
+        M = Agg.indices[Agg.indptr[i]:Agg.indptr[i + 1]]
+        try:
+            simplices = Delaunay(XY[M]).simplices
+        except QhullError:
+            # degenerate (e.g., collinear) aggregate
+            continue
+        k = len(simplices)
+        tris[ntris:ntris + k] = M[simplices]
+        tri_aggs[ntris:ntris + k] = i
+        ntris += k
+
+    return lines, line_aggs, tris[:ntris], tri_aggs[:ntris]
+
+
+_VTK_TYPES = {'<f4': 'Float32', '<f8': 'Float64', '<i4': 'Int32', '<i8': 'Int64',
+              '|u1': 'UInt8'}
+_ZLIB_BLOCK = 1 << 16   # uncompressed bytes per zlib block
+
+
+def write_vtu(V, cells, pdata=None, cdata=None, fname='output.vtu', encoding='ascii'):
+    """Write a .vtu file, with ascii or appended binary data arrays
+
+    Parameters
+    ----------
+    V : {array}
+        Ndof x 3 (if 2, then expanded by 0) point coordinates
+    cells : {dictionary}
+        VTK cell type (e.g. 5 for triangles, see pyamg.vis.write_vtu) to a
+        Ncells x nodes-per-cell array
+    pdata : {array, dictionary}
+        Ndof x Nfields array of scalar values for the vertices, or a
+        dictionary of named Ndof x Ncomponents arrays, each written as one
+        multi-component array (or as Ncomponents scalar fields for 'ascii')
+    cdata : {dictionary}
+        scalar valued cell data, with the same keys as cells
+    fname : {string}
+        file to be written, e.g. 'mymesh.vtu'
+    encoding : {'ascii', 'raw', 'zlib'}
+        'ascii' writes through pyamg.vis.write_vtu.  'raw' appends the arrays
+        as binary data after the xml header, copied straight from the numpy
+        buffers, and 'zlib' compresses them in blocks.
 
+    Returns
+    -------
+    writes a .vtu file for use in Paraview
 
-def my_vis(ml, V, error=None, fname="", E2V=None, Pcols=None):
+    """
+    if isinstance(pdata, dict):
+        pdata = {name: np.asarray(a).reshape(V.shape[0], -1) for name, a in pdata.items()}
+    elif pdata is not None:
+        pdata = np.asarray(pdata).reshape(V.shape[0], -1)
+        pdata = {f'pdata {i}': pdata[:, i:i + 1] for i in range(pdata.shape[1])}
+
+    if encoding == 'ascii':
+        if pdata is not None:
+            pdata = np.hstack(list(pdata.values()))
+        pyamg.vis.write_vtu(V=V, cells=cells, pdata=pdata, cdata=cdata, fname=fname)
+        return
+    if encoding not in ('raw', 'zlib'):
+        raise ValueError('encoding should be ascii, raw or zlib')
+
+    V = np.asarray(V, dtype='<f8')
+    if V.shape[1] == 2:
+        V = np.hstack((V, np.zeros((V.shape[0], 1))))
+    keys = [key for key in cells if len(cells[key]) > 0]
+    conn = [np.asarray(cells[key]).reshape(len(cells[key]), -1) for key in keys]
+    nodes = np.concatenate([np.full(len(c), c.shape[1], dtype='<i8') for c in conn]) \
+        if conn else np.zeros((0,), dtype='<i8')
+
+    # (xml element, name, ncomponents, array), in the order of the file
+    arrays = [('Points', 'vertices', 3, V)]
+    arrays.append(('Cells', 'connectivity', 1,
+                   np.concatenate([c.ravel() for c in conn]).astype('<i8')
+                   if conn else np.zeros((0,), dtype='<i8')))
+    arrays.append(('Cells', 'offsets', 1, np.cumsum(nodes)))
+    arrays.append(('Cells', 'types', 1,
+                   np.repeat(np.array(keys, dtype='<u1'), [len(c) for c in conn])))
+    if pdata is not None:
+        for name, a in pdata.items():
+            arrays.append(('PointData', name, a.shape[1], a.astype('<f8')))
+    if cdata is not None:
+        cd = [np.asarray(cdata[key]).reshape(len(cells[key]), -1) for key in keys]
+        if cd:
+            cd = np.vstack(cd)
+            for i in range(cd.shape[1]):
+                arrays.append(('CellData', f'cdata {i}', 1, cd[:, i].astype('<f8')))
+
+    blocks = [_binary_block(np.ascontiguousarray(a), encoding) for _, _, _, a in arrays]
+
+    compressor = ' compressor="vtkZLibDataCompressor"' if encoding == 'zlib' else ''
+    xml = ['<?xml version="1.0"?>',
+           '<VTKFile type="UnstructuredGrid" version="1.0" byte_order="LittleEndian" '
+           f'header_type="UInt64"{compressor}>',
+           '<UnstructuredGrid>',
+           f'<Piece NumberOfPoints="{V.shape[0]}" NumberOfCells="{len(nodes)}">']
+    offset = 0
+    for section in ('Points', 'Cells', 'PointData', 'CellData'):
+        xml.append(f'<{section}>')
+        for (sec, name, ncomp, a), (header, payload) in zip(arrays, blocks):
+            if sec != section:
+                continue
+            xml.append(f'<DataArray type="{_VTK_TYPES[a.dtype.str]}" Name="{name}" '
+                       f'NumberOfComponents="{ncomp}" format="appended" offset="{offset}"/>')
+            offset += len(header) + sum(len(b) for b in payload)
+        xml.append(f'</{section}>')
+    xml += ['</Piece>', '</UnstructuredGrid>', '<AppendedData encoding="raw">']
+
+    with open(fname, 'wb') as f:
+        f.write('\n'.join(xml).encode() + b'\n_')
+        for header, payload in blocks:
+            f.write(header)
+            for b in payload:
+                f.write(b)
+        f.write(b'\n</AppendedData>\n</VTKFile>\n')
+
+
+def _binary_block(a, encoding):
+    # Header and list of data buffers of one appended array.  For raw data,
+    # the buffer is a view of the array itself.
+    data = memoryview(a).cast('B')
+    if encoding == 'raw':
+        return np.array([data.nbytes], dtype='<u8').tobytes(), [data]
+
+    nblocks = max(1, -(-data.nbytes // _ZLIB_BLOCK))
+    payload = [zlib.compress(data[k * _ZLIB_BLOCK:(k + 1) * _ZLIB_BLOCK])
+               for k in range(nblocks)]
+    last = data.nbytes - (nblocks - 1) * _ZLIB_BLOCK
+    header = [nblocks, _ZLIB_BLOCK, last] + [len(b) for b in payload]
+    return np.array(header, dtype='<u8').tobytes(), payload
+
+
+def my_vis(ml, V, error=None, fname="", E2V=None, Pcols=None, encoding='ascii', workers=1):
     """Coarse grid visualization for 2-D problems, for use with Paraview
        For all levels, outputs meshes, aggregates, near nullspace modes B, and selected
        prolongator basis functions.  Coarse level meshes are constructed by doing a
@@ -296,7 +377,23 @@ def my_vis(ml, V, error=None, fname="", E2V=None, Pcols=None):
     P_cols : {list of tuples}
         Optional input list of tuples of the form [(lvl, [ints]), ...]
         where lvl is an integer defining the level on which to output
-        the list of columns in [ints].
+        the list of columns in [ints].  The columns of a level are written
+        together, to fname + "P_lvl<lvl>.vtu".
+    encoding : {'ascii', 'raw', 'zlib', 'xdmf'}
+        Format of the data arrays in the .vtu files.  The binary formats
+        ('raw', or compressed with 'zlib') are much smaller and faster to
+        write and to load.  See write_vtu.
+            With 'xdmf', no .vtu files are written (or removed).  Instead, the
+        whole hierarchy is written to a single HDF5 file, fname + "hierarchy.h5",
+        indexed by fname + "hierarchy.xmf" for Paraview.  Each array is stored
+        once, and all views of a level refer to the same vertices and
+        elements.  Requires h5py.
+    workers : {integer}
+        Number of processes used to write the levels concurrently.  Each
+        process triangulates its coarse level and writes the mesh, aggregates
+        and B of that level.  The vertices and B of all levels, the fine
+        elements and the aggregates are passed in shared memory rather than
+        pickled for each process.  Not used with 'xdmf'.
 
     Returns
     -------
@@ -310,7 +407,8 @@ def my_vis(ml, V, error=None, fname="", E2V=None, Pcols=None):
     --------
 
      """
-    system('rm -f *.vtu')
+    if encoding == 'xdmf' and h5py is None:
+        raise ImportError('encoding=\'xdmf\' requires h5py')
 
     ##
     # For the purposes of clearer plotting, perturb vertices slightly
@@ -343,73 +441,107 @@ def my_vis(ml, V, error=None, fname="", E2V=None, Pcols=None):
         nPDEs = 1
 
     Agglist = []
-    Agg = sparse.eye(
-        levels[0].A.shape[0] / nPDEs,
-        levels[0].A.shape[1] / nPDEs,
-        format='csr')
+    # aggregate of each fine vertex on the current level (-1 if none), and
+    # the number of fine vertices in each aggregate
+    fine_agg = np.arange(levels[0].A.shape[0] // nPDEs)
+    count = np.ones(len(fine_agg))
     for i in range(1, len(levels)):
         ##
         # Interpolate the vertices to the next level by taking each
-        # aggregate's center of gravity (i.e. average x and y value).
-        Agg = Agg.tocsr() * levels[i - 1].AggOp.tocsr()
-        Agg.data[:] = 1.0
+        # aggregate's center of gravity (i.e. average x and y value).  This is
+        # the average of the previous level's centers, weighted by the number
+        # of fine vertices they represent.
+        AggOp = levels[i - 1].AggOp.tocsr()
+        Nagg = AggOp.shape[1]
+        rows = np.flatnonzero(np.diff(AggOp.indptr))
+        parent = np.full(AggOp.shape[0], -1)
+        parent[rows] = AggOp.indices[AggOp.indptr[rows]]
+
+        fine_agg = np.where(fine_agg >= 0, parent[fine_agg], -1)
+        aggregated = fine_agg >= 0
+        Agg = csr_matrix((np.ones(aggregated.sum()), fine_agg[aggregated],
+                          np.concatenate(([0], np.cumsum(aggregated)))),
+                         shape=(len(fine_agg), Nagg))
         Agglist.append(Agg)
 
-        AggX = pyamg.util.utils.scale_rows(Agg, Vlist[0][:, 0], copy=True)
-        AggY = pyamg.util.utils.scale_rows(Agg, Vlist[0][:, 1], copy=True)
-        AggX = ones((1, AggX.shape[0])) * AggX
-        AggY = ones((1, AggY.shape[0])) * AggY
-        Agg = Agg.tocsc()
-        count = Agg.indptr[1:] - Agg.indptr[:-1]
-        AggX = (np.ravel(AggX) / count).reshape(-1, 1)
-        AggY = (np.ravel(AggY) / count).reshape(-1, 1)
-        Vlist.append(np.hstack((AggX, AggY)))
-
-        E2Vnew = Delaunay(Vlist[i][:, 0:2]).simplices
-        E2Vlist.append(E2Vnew)
+        weights = count[rows]
+        count = np.bincount(parent[rows], weights=weights, minlength=Nagg)
+        Vc = [np.bincount(parent[rows], weights=weights * Vlist[i - 1][rows, k],
+                          minlength=Nagg) / count for k in range(2)]
+        Vlist.append(np.column_stack(Vc))
+
+        # coarse meshes are triangulated below, level by level
+        E2Vlist.append(None)
         mesh_type_list.append('tri')
         mesh_num_list.append(5)
 
+    if encoding == 'xdmf':
+        for i in range(1, len(levels)):
+            E2Vlist[i] = Delaunay(Vlist[i][:, 0:2]).simplices
+        write_xdmf(fname + "hierarchy", levels, Vlist, E2Vlist, mesh_type_list,
+                   Agglist, error=error, Pcols=Pcols)
+        return
+
+    system('rm -f *.vtu')
+
     ##
     # On each level, output aggregates, B, the mesh
+    tasks = []
     for i in range(len(levels)):
-        mesh_num = mesh_num_list[i]
-        mesh_type = mesh_type_list[i]
-        vertices = Vlist[i]
-        elements = E2Vlist[i]
-        # Print mesh
-        print(i)
-        pyamg.vis.write_basic_mesh(vertices, elements, mesh_type=mesh_type,
-                                   fname=fname + "mesh_lvl" + str(i) + ".vtu")
-        # Visualize the aggregates
-        if i != (len(levels) - 1):
-            dg_vis(fname + "aggs_lvl" + str(i), Vlist[0],
-                   E2Vlist[0], Agglist[i], mesh_type)
-        # Visualize B
         if sparse.isspmatrix_bsr(levels[i].A):
             nPDEs = levels[i].A.blocksize[0]
         else:
             nPDEs = 1
-        cell_stuff = {mesh_num: elements}
-        for j in range(nPDEs):
-            indys = np.arange(j, levels[i].A.shape[0], nPDEs)
-            pyamg.vis.write_vtu(V=vertices,
-                                cells=cell_stuff,
-                                pdata=levels[i].B[indys, :].real,
-                                fname=fname + "B_variable" + str(j) + "_lvl" + str(i) + ".vtu")
-
-    # Output requested prolongator basis functions
+        tasks.append((mesh_num_list[i], mesh_type_list[i], nPDEs, fname, encoding, i))
+
+    if workers > 1:
+        # the vertices and B of all levels, the fine elements and the
+        # aggregates in one shared block, so that they are not pickled
+        arrays = {'E2V': E2Vlist[0]}
+        for i in range(len(levels)):
+            arrays[f'V{i}'] = Vlist[i]
+            arrays[f'B{i}'] = levels[i].B
+        for i, Agg in enumerate(Agglist):
+            for name in ('data', 'indices', 'indptr'):
+                arrays[f'Agg{i}.{name}'] = getattr(Agg, name)
+        layout = {}
+        size = 0
+        for key, a in arrays.items():
+            layout[key] = (size, a.shape, a.dtype.str)
+            size += -(-a.nbytes // 16) * 16   # aligned to 16 bytes
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        try:
+            for key, a in arrays.items():
+                _shared_view(shm, layout[key])[...] = a
+            agg_shapes = [Agg.shape for Agg in Agglist] + [None]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                coarse = list(executor.map(_write_level_shared,
+                                           [(shm.name, layout, agg_shapes[t[-1]]) + t
+                                            for t in tasks]))
+            E2Vlist = E2Vlist[:1] + coarse[1:]
+        finally:
+            shm.close()
+            shm.unlink()
+    else:
+        for t in tasks:
+            i = t[-1]
+            Agg = Agglist[i] if i != (len(levels) - 1) else None
+            E2Vlist[i] = _write_level(Vlist[i], Vlist[0], E2Vlist[i], t[0], t[1],
+                                      levels[i].B, t[2], Agg, E2Vlist[0], *t[3:])
+
+    # Output requested prolongator basis functions, all columns of a level
+    # as one multi-component array
     if Pcols is not None:
         for (lvl, cols) in Pcols:
-            P = levels[lvl].P.tocsc()
+            Pc = levels[lvl].P.tocsc()[:, list(cols)].toarray().real
             cell_stuff = {mesh_num_list[lvl]: E2Vlist[lvl]}
-            for i in cols:
-                Pcol = array(P[:, i].todense())
-                pyamg.vis.write_vtu(
-                    V=Vlist[lvl],
-                    cells=cell_stuff,
-                    pdata=Pcol,
-                    fname=fname + "P_lvl" + str(lvl) + "col" + str(i) + ".vtu")
+            name = 'P columns ' + ' '.join(str(c) for c in cols)
+            write_vtu(
+                V=Vlist[lvl],
+                cells=cell_stuff,
+                pdata={name: Pc},
+                fname=fname + "P_lvl" + str(lvl) + ".vtu",
+                encoding=encoding)
 
     # Output the error on the finest level
     if error is not None:
@@ -421,5 +553,173 @@ def my_vis(ml, V, error=None, fname="", E2V=None, Pcols=None):
             nPDEs = 1
         for j in range(nPDEs):
             indys = np.arange(j, levels[0].A.shape[0], nPDEs)
-            pyamg.vis.write_vtu(V=Vlist[0], cells=cell_stuff, pdata=error[indys, :],
-                                fname=fname + "error_variable" + str(j) + ".vtu")
+            write_vtu(V=Vlist[0], cells=cell_stuff, pdata=error[indys, :],
+                      fname=fname + "error_variable" + str(j) + ".vtu", encoding=encoding)
+
+
+def _write_level(V, Vfine, E2V, mesh_num, mesh_type, B, nPDEs, Agg, E2Vfine, fname, encoding, i):
+    # Helper function for my_vis: output the mesh, aggregates and B of level
+    # i, and return the elements of the level (triangulated if E2V is None)
+    if E2V is None:
+        E2V = Delaunay(V[:, 0:2]).simplices
+    # Print mesh
+    print(i)
+    write_vtu(V=V, cells={mesh_num: E2V},
+              fname=fname + "mesh_lvl" + str(i) + ".vtu", encoding=encoding)
+    # Visualize the aggregates
+    if Agg is not None:
+        dg_vis(fname + "aggs_lvl" + str(i), Vfine,
+               E2Vfine, Agg, mesh_type, encoding=encoding)
+    # Visualize B
+    cell_stuff = {mesh_num: E2V}
+    for j in range(nPDEs):
+        indys = np.arange(j, B.shape[0], nPDEs)
+        write_vtu(V=V,
+                  cells=cell_stuff,
+                  pdata=B[indys, :].real,
+                  fname=fname + "B_variable" + str(j) + "_lvl" + str(i) + ".vtu",
+                  encoding=encoding)
+    return E2V
+
+
+def _shared_view(shm, entry):
+    # array of the shared memory block shm, at (offset, shape, dtype) entry
+    offset, shape, dtype = entry
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+
+
+def _write_level_shared(args):
+    # Process pool version of _write_level, with the arrays of all levels in
+    # the shared memory block args[0], as laid out in args[1], and the shape
+    # of the aggregates of the level in args[2] (None on the coarsest level).
+    # Returns the elements of a coarse level, which are triangulated here.
+    shm_name, layout, agg_shape = args[:3]
+    mesh_num, mesh_type, nPDEs, fname, encoding, i = args[3:]
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        def view(key):
+            return _shared_view(shm, layout[key])
+        Agg = None
+        if agg_shape is not None:
+            Agg = csr_matrix((view(f'Agg{i}.data'), view(f'Agg{i}.indices'),
+                              view(f'Agg{i}.indptr')), shape=agg_shape)
+        E2V = _write_level(view(f'V{i}'), view('V0'), view('E2V') if i == 0 else None,
+                           mesh_num, mesh_type, view(f'B{i}'), nPDEs, Agg,
+                           view('E2V'), fname, encoding, i)
+        del Agg
+        return E2V if i > 0 else None
+    finally:
+        shm.close()
+
+
+_XDMF_TOPOLOGY = {'vertex': 'Polyvertex', 'tri': 'Triangle', 'quad': 'Quadrilateral'}
+
+
+def write_xdmf(fname, levels, Vlist, E2Vlist, mesh_type_list, Agglist, error=None, Pcols=None):
+    """Write a multilevel hierarchy to one HDF5 file with an XDMF index
+
+    Writes fname.h5 with a group per level (vertices, elements, B and
+    requested P columns) and per aggregation (the aggregate of each fine
+    vertex, and lines and triangles from aggregate_cells, with colors), and
+    fname.xmf with one grid per level and three grids (points, lines and
+    triangles on the fine vertices) per aggregation.  The grids refer to the
+    HDF5 datasets, so that, e.g., the fine vertices are stored only once.
+
+    Parameters
+    ----------
+    fname : {string}
+        base name of the two files
+    levels : {list}
+        ml.levels
+    Vlist, E2Vlist, mesh_type_list : {list}
+        vertices, elements and mesh type of each level
+    Agglist : {list}
+        fine-vertex to aggregate relationship of each coarse level
+    error : {array}
+        optional fine grid error
+    Pcols : {list of tuples}
+        see my_vis
+    """
+    Ncolors = 16  # as in dg_vis
+    h5name = fname + '.h5'
+    h5base = h5name.split('/')[-1]
+    grids = []
+
+    def item(dset):
+        kind = 'Int' if np.issubdtype(dset.dtype, np.integer) else 'Float'
+        dims = ' '.join(str(d) for d in dset.shape)
+        return (f'<DataItem Dimensions="{dims}" NumberType="{kind}" '
+                f'Precision="{dset.dtype.itemsize}" Format="HDF">{h5base}:{dset.name}</DataItem>')
+
+    def grid(name, topology, elements, vertices, attributes):
+        nodes = elements.shape[1] if elements.ndim > 1 else 1
+        per = f' NodesPerElement="{nodes}"' if topology in ('Polyline', 'Polyvertex') else ''
+        geometry = 'XY' if vertices.shape[1] == 2 else 'XYZ'
+        lines = [f'<Grid Name="{name}" GridType="Uniform">',
+                 f'<Topology TopologyType="{topology}" NumberOfElements="{elements.shape[0]}"{per}>',
+                 item(elements), '</Topology>',
+                 f'<Geometry GeometryType="{geometry}">', item(vertices), '</Geometry>']
+        for aname, center, dset in attributes:
+            lines += [f'<Attribute Name="{aname}" AttributeType="Scalar" Center="{center}">',
+                      item(dset), '</Attribute>']
+        lines.append('</Grid>')
+        grids.append('\n'.join(lines))
+
+    Pcols = dict(Pcols) if Pcols is not None else {}
+
+    with h5py.File(h5name, 'w') as f:
+        for i, lvl in enumerate(levels):
+            g = f.create_group(f'level{i}')
+            vertices = g.create_dataset('vertices', data=Vlist[i])
+            elements = g.create_dataset('elements', data=E2Vlist[i])
+            attributes = []
+
+            if sparse.isspmatrix_bsr(lvl.A):
+                nPDEs = lvl.A.blocksize[0]
+            else:
+                nPDEs = 1
+            for j in range(nPDEs):
+                Bj = lvl.B[j::nPDEs, :].real
+                for k in range(Bj.shape[1]):
+                    name = f'B_variable{j}_{k}'
+                    attributes.append((name, 'Node', g.create_dataset(name, data=Bj[:, k])))
+
+            if i in Pcols:
+                Pc = lvl.P.tocsc()[:, list(Pcols[i])].toarray().real
+                for k, c in enumerate(Pcols[i]):
+                    name = f'P_col{c}'
+                    attributes.append((name, 'Node', g.create_dataset(name, data=Pc[:, k])))
+
+            if i == 0 and error is not None:
+                error = np.ravel(error)
+                for j in range(nPDEs):
+                    name = f'error_variable{j}'
+                    attributes.append((name, 'Node', g.create_dataset(name, data=error[j::nPDEs])))
+
+
+            grid(f'mesh_lvl{i}', _XDMF_TOPOLOGY[mesh_type_list[i]], elements, vertices, attributes)
+
+        fine = f['level0/vertices']
+        for i, Agg in enumerate(Agglist):
+            g = f.create_group(f'aggs_lvl{i}')
+            # the aggregate of each fine vertex, on a point grid of the fine vertices
+            Agg = coo_matrix(Agg)
+            colors = np.zeros(Agg.shape[0])
+            colors[Agg.row] = Agg.col % Ncolors
+            points = g.create_dataset('points', data=np.arange(Agg.shape[0]))
+            grid(f'aggs_lvl{i}_points', 'Polyvertex', points, fine,
+                 [('aggregate', 'Node', g.create_dataset('point_colors', data=colors))])
+            lines, line_aggs, tris, tri_aggs = aggregate_cells(Vlist[0], Agglist[i])
+            for name, topology, cells, aggs in (('lines', 'Polyline', lines, line_aggs),
+                                                ('tris', 'Triangle', tris, tri_aggs)):
+                if len(cells) == 0:
+                    continue
+                cells = g.create_dataset(name, data=cells)
+                colors = g.create_dataset(name + '_colors', data=aggs % Ncolors)
+                grid(f'aggs_lvl{i}_{name}', topology, cells, fine,
+                     [('aggregate', 'Cell', colors)])
+
+    with open(fname + '.xmf', 'w') as f:
+        f.write('<?xml version="1.0" ?>\n<Xdmf Version="3.0">\n<Domain>\n')
+        f.write('\n'.join(grids))
+        f.write('\n</Domain>\n</Xdmf>\n')
@@ -0,0 +1,285 @@
+"""Per-level breakdown of the setup of an aggregation-based hierarchy
+
+Within a `with SetupTrace():` block, the functions called by
+smoothed_aggregation_solver and rootnode_solver to build each level are
+timed, and optionally the peak of the memory allocated in each of them is
+recorded (tracemalloc).  The stages are
+
+    strength    strength of connection (and eliminate_diag_dom_nodes)
+    aggregation standard, naive, lloyd or pairwise aggregation
+    improve B   relaxation of the candidates (improve_candidates)
+    tentative   fit_candidates
+    smooth P    prolongation (and restriction) smoothing
+    RAP         Galerkin product R A P
+    smoother    setup of the pre- and postsmoother
+    other       the rest of the level, e.g., the transpose of P
+
+Each stage is recorded as an event {'level', 'stage', 'time', 'memory'},
+so that the trace can be written to JSON and the table made again later:
+
+    >>> import pyamg
+    >>> from setup_trace import SetupTrace
+    >>> A = pyamg.gallery.poisson((100, 100), format='csr')
+    >>> with SetupTrace(memory=True) as trace:
+    ...     ml = pyamg.smoothed_aggregation_solver(A)
+    >>> print(trace.table())
+    >>> trace.write('setup_trace.json')
+
+The functions are replaced by name in the modules of the solvers (as these
+call them), and restored on exit.  One setup should be run per block.
+"""
+import json
+import tracemalloc
+from functools import wraps
+from time import perf_counter
+
+from scipy.sparse.linalg import LinearOperator
+from pyamg.multilevel import MultilevelSolver
+import pyamg.aggregation.aggregation
+import pyamg.aggregation.rootnode
+import pyamg.relaxation.smoothing
+
+__all__ = ['SetupTrace', 'stages', 'table']
+
+stages = ['strength', 'aggregation', 'improve B', 'tentative', 'smooth P',
+          'RAP', 'smoother', 'other']
+
+_functions = {
+    'strength': ['symmetric_strength_of_connection',
+                 'classical_strength_of_connection',
+                 'distance_strength_of_connection',
+                 'evolution_strength_of_connection',
+                 'energy_based_strength_of_connection',
+                 'algebraic_distance', 'affinity_distance',
+                 'eliminate_diag_dom_nodes'],
+    'aggregation': ['standard_aggregation', 'naive_aggregation',
+                    'lloyd_aggregation', 'pairwise_aggregation'],
+    'tentative': ['fit_candidates'],
+    'smooth P': ['jacobi_prolongation_smoother',
+                 'richardson_prolongation_smoother',
+                 'energy_prolongation_smoother'],
+}
+
+_modules = [pyamg.aggregation.aggregation, pyamg.aggregation.rootnode]
+
+
+class SetupTrace:
+    """
+    Context manager recording the setup stages of each level
+
+    Parameters
+    ----------
+    memory : bool
+        If True, the peak of the traced memory (tracemalloc) of each stage,
+        over the memory allocated at its start, is recorded in bytes.
+        Tracing allocations slows the setup down, so the times of a traced
+        setup are best not compared to those of an untraced one.
+
+    Attributes
+    ----------
+    events : list
+        One dict per stage and level
+    total : float
+        Time (s) spent in the block
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.events = []
+        self.total = None
+        self._levels = None
+        self._level = None
+        self._saved = []
+
+    # recording
+
+    def _start(self):
+        if self.memory:
+            tracemalloc.reset_peak()
+            return perf_counter(), tracemalloc.get_traced_memory()[0]
+        return perf_counter(), None
+
+    def _stop(self, level, stage, start):
+        tic, base = start
+        time = perf_counter() - tic
+        memory = None
+        if base is not None:
+            memory = tracemalloc.get_traced_memory()[1] - base
+        self.events.append({'level': level, 'stage': stage, 'time': time,
+                            'memory': memory})
+
+    def _stage(self, stage, fn):
+        @wraps(fn)
+        def traced(*args, **kwargs):
+            start = self._start()
+            value = fn(*args, **kwargs)
+            self._stop(self._level, stage, start)
+            return value
+        return traced
+
+    def _improve(self, fn):
+        # the relaxation is applied to B as a LinearOperator, so that the
+        # operator is wrapped as well
+        @wraps(fn)
+        def traced(*args, **kwargs):
+            start = self._start()
+            op = fn(*args, **kwargs)
+            self._stop(self._level, 'improve B', start)
+            return LinearOperator(op.shape, dtype=op.dtype,
+                                  matvec=self._stage('improve B', op.matvec),
+                                  matmat=self._stage('improve B', op.matmat))
+        return traced
+
+    def _extend(self, fn):
+        @wraps(fn)
+        def traced(levels, *args, **kwargs):
+            self._levels = levels
+            self._level = len(levels) - 1
+            self._rap = None
+            n = len(self.events)
+            tic = perf_counter()
+            value = fn(levels, *args, **kwargs)
+            time = perf_counter() - tic
+            # the Galerkin product follows the creation of the next level
+            if self._rap is not None:
+                self._stop(self._level, 'RAP', self._rap)
+            time -= sum(e['time'] for e in self.events[n:])
+            self.events.append({'level': self._level, 'stage': 'other',
+                                'time': time, 'memory': None})
+            return value
+        return traced
+
+    def _new_level(self):
+        self._rap = self._start()
+        return self._Level()
+
+    def _setup_call(self, fn):
+        @wraps(fn)
+        def setup_call(name):
+            setup = fn(name)
+
+            @wraps(setup)
+            def traced(lvl, *args, **kwargs):
+                level = next((i for i, l in enumerate(self._levels or [])
+                              if l is lvl), None)
+                start = self._start()
+                smoother = setup(lvl, *args, **kwargs)
+                self._stop(level, 'smoother', start)
+                return smoother
+            return traced
+        return setup_call
+
+    # patching
+
+    def _patch(self, obj, name, value):
+        self._saved.append((obj, name, getattr(obj, name)))
+        setattr(obj, name, value)
+
+    def __enter__(self):
+        for module in _modules:
+            for stage, names in _functions.items():
+                for name in names:
+                    if hasattr(module, name):
+                        self._patch(module, name,
+                                    self._stage(stage, getattr(module, name)))
+            if hasattr(module, 'relaxation_as_linear_operator'):
+                self._patch(module, 'relaxation_as_linear_operator',
+                            self._improve(module.relaxation_as_linear_operator))
+            self._patch(module, '_extend_hierarchy',
+                        self._extend(module._extend_hierarchy))
+        self._Level = MultilevelSolver.Level
+        self._patch(MultilevelSolver, 'Level', staticmethod(self._new_level))
+        self._patch(pyamg.relaxation.smoothing, '_setup_call',
+                    self._setup_call(pyamg.relaxation.smoothing._setup_call))
+
+        self._tracing = self.memory and not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+        self._tic = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.total = perf_counter() - self._tic
+        if self._tracing:
+            tracemalloc.stop()
+        for obj, name, value in reversed(self._saved):
+            setattr(obj, name, value)
+        self._saved = []
+        self._levels = None
+
+    # output
+
+    def table(self):
+        """Table of the time (and memory) of each stage on each level."""
+        return table(self.events, self.total)
+
+    def to_dict(self):
+        """Trace as a JSON-serializable dict."""
+        return {'total': self.total, 'events': self.events}
+
+    def write(self, fname):
+        """Write the trace to a JSON file."""
+        with open(fname, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+
+def table(events, total=None, fw=9):
+    """
+    Table of the setup stages (columns) on each level (rows)
+
+    Parameters
+    ----------
+    events : list
+        See SetupTrace.events, e.g., read from a file written by
+        SetupTrace.write
+    total : float
+        Time of the whole setup; the time not spent on any level (e.g.,
+        checking the arguments) is then reported as well
+    fw : int
+        Field width
+
+    Returns
+    -------
+    str
+        The time (s) of each stage, and its peak memory (MB) if recorded
+    """
+    levels = sorted({e['level'] for e in events if e['level'] is not None})
+    columns = [s for s in stages if any(e['stage'] == s for e in events)]
+
+    def sums(key, columns):
+        rows = {lvl: dict.fromkeys(columns, 0.0) for lvl in levels}
+        for e in events:
+            if e['level'] is not None and e[key] is not None:
+                rows[e['level']][e['stage']] += e[key]
+        return rows
+
+    def rows(data, columns, unit, fmt, reduce, last):
+        header = ['Level'] + columns + [last]
+        hline = '|'.join(["-"*(fw+2) for h in header])
+        header = '|'.join([f'{h:^{fw+2}}' for h in header])
+        out = [unit, '|'+header+'|', '|'+hline+'|']
+        for lvl in levels:
+            row = [data[lvl][s] for s in columns]
+            row = ' | '.join(f'{v:{fw}{fmt}}' for v in row + [reduce(row)])
+            out.append(f'| {lvl:>{fw}d} | {row} |')
+        row = [reduce([data[lvl][s] for lvl in levels]) for s in columns]
+        row = ' | '.join(f'{v:{fw}{fmt}}' for v in row + [reduce(row)])
+        out.append(f"| {'all':>{fw}} | {row} |")
+        return out
+
+    out = rows(sums('time', columns), columns, 'time (s) of each setup stage',
+               '.5f', sum, 'Total')
+    if total is not None:
+        staged = sum(e['time'] for e in events)
+        out.append(f'total {total:.5f} s, of which {total - staged:.5f} s '
+                   'outside of the stages')
+    # the memory of 'other' is not recorded
+    columns = [s for s in columns
+               if any(e['stage'] == s and e['memory'] is not None for e in events)]
+    if columns:
+        MB = 1024**2
+        data = {lvl: {s: v / MB for s, v in row.items()}
+                for lvl, row in sums('memory', columns).items()}
+        out += [''] + rows(data, columns, 'peak memory (MB) of each setup stage',
+                           '.3f', max, 'Max')
+    return '\n'.join(out)
@@ -0,0 +1,237 @@
+"""Per-level counters for the solve phase of a multilevel solver
+
+Within a `with SolveTrace(ml):` block, the cycles of ml are instrumented: on
+each level, the calls to the pre- and postsmoother, the residual (products
+with A), the restriction (R), the prolongation (P) and the coarse solve are
+counted and timed, together with an estimate of the bytes moved.
+
+    >>> import numpy as np
+    >>> import pyamg
+    >>> from solve_trace import SolveTrace
+    >>> A = pyamg.gallery.poisson((100, 100), format='csr')
+    >>> ml = pyamg.smoothed_aggregation_solver(A)
+    >>> b = np.random.rand(A.shape[0])
+    >>> with SolveTrace(ml) as trace:
+    ...     x = ml.solve(b, tol=1e-8)
+    >>> print(trace.table())
+
+The hierarchy itself is not changed: A, R and P of each level are replaced
+by counting operators, and the smoothers and the coarse solver by counting
+functions, which are restored on exit.  On the finest level, the products
+with A also include those of solve() (the residual norms) and of any Krylov
+method that is given ml.levels[0].A, e.g., through solve(accel='cg').
+
+The bytes of a product are those of the matrix (data, indices and indptr),
+the input and the output vector.  The bytes of a smoother are estimated as
+one such pass over A per sweep, i.e., per iteration (two for symmetric
+sweeps), read from the options of the smoother where available.
+"""
+from functools import wraps
+from time import perf_counter
+
+import numpy as np
+import scipy.sparse as sparse
+from scipy.sparse.linalg import LinearOperator
+
+__all__ = ['SolveTrace', 'stages', 'table']
+
+stages = ['presmoother', 'residual', 'restriction', 'coarse solve',
+          'prolongation', 'postsmoother']
+
+
+def _nbytes(M):
+    # bytes held by the arrays of a sparse matrix or an array
+    if sparse.issparse(M):
+        return sum(getattr(M, a).nbytes for a in ('data', 'indices', 'indptr')
+                   if hasattr(M, a))
+    return np.asarray(M).nbytes
+
+
+def _sweeps(smoother):
+    # passes over A of one call, from the options of the smoother
+    keywords = getattr(smoother, 'keywords', {})
+    sweeps = keywords.get('iterations', 1)
+    if keywords.get('sweep') == 'symmetric':
+        sweeps *= 2
+    return sweeps
+
+
+class _Operator(LinearOperator):
+    # counts and times the products with a matrix, and passes on all other
+    # attributes (e.g., nnz, symmetry) to the matrix
+
+    def __init__(self, M, record):
+        self.M = M
+        self.record = record
+        self.nbytes = _nbytes(M)
+        super().__init__(M.dtype, M.shape)
+
+    def _matvec(self, x):
+        return self._matmat(x)
+
+    def _matmat(self, X):
+        tic = perf_counter()
+        Y = self.M @ X
+        self.record(perf_counter() - tic, 1, self.nbytes + X.nbytes + Y.nbytes)
+        return Y
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__['M'], name)
+
+
+class SolveTrace:
+    """
+    Context manager counting the work of each level in the cycles of ml
+
+    Parameters
+    ----------
+    ml : MultilevelSolver
+        Hierarchy whose cycles are recorded
+
+    Attributes
+    ----------
+    counters : dict
+        {(level, stage): {'calls', 'time', 'passes', 'bytes'}}, where
+        passes counts the products with a matrix (or sweeps of a smoother)
+    cycles : int
+        Number of cycles, i.e., of calls of the finest presmoother
+    total : float
+        Time (s) spent in the block
+    """
+
+    def __init__(self, ml):
+        self.ml = ml
+        self.counters = {}
+        self.cycles = 0
+        self.total = None
+        self._saved = []
+
+    def _recorder(self, level, stage):
+        counter = self.counters.setdefault(
+            (level, stage), {'calls': 0, 'time': 0.0, 'passes': 0, 'bytes': 0})
+
+        def record(time, passes, nbytes):
+            counter['calls'] += 1
+            counter['time'] += time
+            counter['passes'] += passes
+            counter['bytes'] += nbytes
+        return record
+
+    def _smoother(self, level, stage, smoother):
+        record = self._recorder(level, stage)
+        sweeps = _sweeps(smoother)
+        nbytes = _nbytes(self.ml.levels[level].A)
+
+        @wraps(smoother)
+        def traced(A, x, b):
+            if level == 0 and stage == 'presmoother':
+                self.cycles += 1
+            A = getattr(A, 'M', A)   # the smoothers need the matrix
+            tic = perf_counter()
+            smoother(A, x, b)
+            record(perf_counter() - tic, sweeps,
+                   sweeps * (nbytes + x.nbytes + b.nbytes))
+        return traced
+
+    def _coarse_solver(self, solver):
+        record = self._recorder(len(self.ml.levels) - 1, 'coarse solve')
+
+        @wraps(solver)
+        def traced(A, b):
+            tic = perf_counter()
+            x = solver(A, b)
+            record(perf_counter() - tic, 1, b.nbytes + x.nbytes)
+            return x
+        return traced
+
+    def _patch(self, obj, name, value):
+        self._saved.append((obj, name, getattr(obj, name)))
+        setattr(obj, name, value)
+
+    def __enter__(self):
+        levels = self.ml.levels
+        for i, lvl in enumerate(levels[:-1]):
+            self._patch(lvl, 'presmoother',
+                        self._smoother(i, 'presmoother', lvl.presmoother))
+            self._patch(lvl, 'postsmoother',
+                        self._smoother(i, 'postsmoother', lvl.postsmoother))
+            self._patch(lvl, 'A', _Operator(lvl.A, self._recorder(i, 'residual')))
+            self._patch(lvl, 'R', _Operator(lvl.R, self._recorder(i, 'restriction')))
+            self._patch(lvl, 'P', _Operator(lvl.P, self._recorder(i, 'prolongation')))
+        self._patch(self.ml, 'coarse_solver', self._coarse_solver(self.ml.coarse_solver))
+        self._tic = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.total = perf_counter() - self._tic
+        for obj, name, value in reversed(self._saved):
+            setattr(obj, name, value)
+        self._saved = []
+
+    def table(self):
+        """Table of the time and the work of each stage on each level."""
+        return table(self.counters, self.cycles, self.total)
+
+
+def table(counters, cycles, total=None, fw=9):
+    """
+    Table of the solve stages (columns) on each level (rows)
+
+    Parameters
+    ----------
+    counters : dict
+        See SolveTrace.counters
+    cycles : int
+        Number of cycles, to report the work per cycle
+    total : float
+        Time of the whole block; the time outside of the stages (e.g., in
+        a Krylov method) is then reported as well
+    fw : int
+        Field width
+
+    Returns
+    -------
+    str
+        The time (s) of each stage, and per cycle, the calls, the products
+        with a matrix (or smoother sweeps) and the MB moved on each level
+    """
+    levels = sorted({lvl for lvl, _ in counters})
+    columns = [s for s in stages if any(s == stage for _, stage in counters)]
+    zero = {'calls': 0, 'time': 0.0, 'passes': 0, 'bytes': 0}
+
+    header = ['Level'] + columns + ['Total']
+    hline = '|'.join(["-"*(fw+2) for h in header])
+    header = '|'.join([f'{h:^{fw+2}}' for h in header])
+    out = ['time (s) of each solve stage', '|'+header+'|', '|'+hline+'|']
+    for lvl in levels:
+        row = [counters.get((lvl, s), zero)['time'] for s in columns]
+        row = ' | '.join(f'{v:{fw}.5f}' for v in row + [sum(row)])
+        out.append(f'| {lvl:>{fw}d} | {row} |')
+    row = [sum(counters.get((lvl, s), zero)['time'] for lvl in levels) for s in columns]
+    row = ' | '.join(f'{v:{fw}.5f}' for v in row + [sum(row)])
+    out.append(f"| {'all':>{fw}} | {row} |")
+    if total is not None:
+        staged = sum(c['time'] for c in counters.values())
+        out.append(f'total {total:.5f} s, of which {total - staged:.5f} s '
+                   'outside of the stages')
+
+    cycles = max(cycles, 1)
+    header = ['Level', 'Calls', 'Matvecs', 'Sweeps', 'MB', 'Time (s)']
+    hline = '|'.join(["-"*(fw+2) for h in header])
+    header = '|'.join([f'{h:^{fw+2}}' for h in header])
+    out += ['', f'per cycle ({cycles} cycles), products with A, R, P and '
+            'smoother sweeps', '|'+header+'|', '|'+hline+'|']
+    MB = 1024**2
+    for lvl in levels:
+        c = [counters[key] for key in counters if key[0] == lvl]
+        calls = sum(ci['calls'] for ci in c)
+        matvecs = sum(counters.get((lvl, s), zero)['passes']
+                      for s in ('residual', 'restriction', 'prolongation'))
+        sweeps = sum(counters.get((lvl, s), zero)['passes']
+                     for s in ('presmoother', 'postsmoother'))
+        nbytes = sum(ci['bytes'] for ci in c)
+        time = sum(ci['time'] for ci in c)
+        out.append(f'| {lvl:>{fw}d} | {calls / cycles:{fw}.1f} '
+                   f'| {matvecs / cycles:{fw}.1f} | {sweeps / cycles:{fw}.1f} '
+                   f'| {nbytes / MB / cycles:{fw}.3f} | {time / cycles:{fw}.5f} |')
+    return '\n'.join(out)